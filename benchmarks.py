@@ -0,0 +1,496 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks for the data preparation code in utils.py
+
+Run the whole pipeline suite with: python benchmarks.py suite
+Save a baseline with --save baseline.json, later runs given --baseline baseline.json
+exit with status 1 if any stage got slower or used more memory than the threshold allows.
+Comparisons of old and new implementations run with: python benchmarks.py micro
+Cold import and first query times run with: python benchmarks.py startup (also takes --save/--baseline)
+Correctness checks of edge cases the benchmarks don't cover run with: python benchmarks.py check
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import utils
+from geocoding import GeocodingEngine, StubBackend
+from instrument import TracedPeak
+
+CSV_PATH = "fatal-police-shootings-data.csv"
+# Coordinates Nominatim gave the locations later fixed in coordinate-overrides.csv, taken from
+# the plots in FindIncorrectCoord.ipynb (fixes that moved a point less than 10 km are left out)
+KNOWN_BAD_PATH = "known-bad-coordinates.csv"
+
+
+def make_synthetic_data(num_rows, seed=0):
+    """
+    Create a synthetic version of the WaPo dataset by sampling rows of the bundled CSV
+
+    Args:
+        num_rows: Number of rows in the synthetic dataframe
+        seed: Seed for the random number generator
+    Returns:
+        Pandas dataframe with the same columns as the original dataset
+    """
+    data = pd.read_csv(CSV_PATH)
+    rng = np.random.RandomState(seed)
+    sample = data.iloc[rng.randint(0, len(data), size=num_rows)].reset_index(drop=True)
+    sample['id'] = np.arange(num_rows)
+    return sample
+
+
+def make_synthetic_coordinates(data, seed=0):
+    """
+    Create fake geocoding results for every city/state pair in the dataframe
+
+    Args:
+        data: Pandas dataframe of WaPo dataset
+        seed: Seed for the random number generator
+    Returns:
+        Dictionary mapping (city, state) tuples to [latitude, longitude]
+    """
+    rng = np.random.RandomState(seed)
+    pairs = list(data.groupby(['city', 'state']).groups.keys())
+    lats = rng.uniform(25, 49, size=len(pairs))
+    lons = rng.uniform(-124, -67, size=len(pairs))
+    return {pair: [lat, lon] for pair, lat, lon in zip(pairs, lats, lons)}
+
+
+def _assign_coordinates_masked(data, coordinates):
+    """
+    Original per-pair boolean mask assignment from get_coordinates, kept as a reference
+    """
+    for (city, state), (latitude, longitude) in coordinates.items():
+        data.loc[(data['city'] == city) & (data['state'] == state), 'lat'] = latitude
+        data.loc[(data['city'] == city) & (data['state'] == state), 'lon'] = longitude
+    return data
+
+
+def _add_location_features_loop(data):
+    """
+    Original per-location loop from DataPreparation.ipynb, kept as a reference
+    """
+    # Newer pandas won't put strings into the float column created when the first value is NaN
+    data['num_shootings'] = np.nan
+    data['common_armed'] = pd.Series(np.nan, index=data.index, dtype=object)
+    for (city, state), row in data.groupby(['city', 'state'], observed=True):
+        num = len(data.loc[(data['city'] == city) & (data['state'] == state)].index)
+        common_armed = data.loc[(data['city'] == city) & (data['state'] == state), 'armed'].value_counts(dropna=False).sort_index().idxmax()
+        data.loc[(data['city'] == city) & (data['state'] == state), 'num_shootings'] = num
+        data.loc[(data['city'] == city) & (data['state'] == state), 'common_armed'] = common_armed
+    data['num_shootings'] = data['num_shootings'].astype(int)
+
+
+def timeit(func, *args):
+    """
+    Time a single call of a function
+
+    Args:
+        func: Function to call
+        *args: Arguments passed to func
+    Returns:
+        Tuple of (return value, elapsed seconds)
+    """
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def bench_assign_coordinates(num_rows):
+    """
+    Compare mask based coordinate assignment with the vectorized join
+
+    Args:
+        num_rows: Number of rows in the synthetic dataframe
+    Returns:
+        None, prints timings
+    """
+    data = make_synthetic_data(num_rows)
+    coordinates = make_synthetic_coordinates(data)
+    masked, masked_time = timeit(_assign_coordinates_masked, data.copy(), coordinates)
+    joined, joined_time = timeit(utils.assign_coordinates, data.copy(), coordinates)
+    pd.testing.assert_frame_equal(masked, joined)
+    print("assign_coordinates (%d rows, %d locations)" % (num_rows, len(coordinates)))
+    print("  boolean masks:   %8.3f s" % masked_time)
+    print("  vectorized join: %8.3f s (%.0fx faster)" % (joined_time, masked_time / joined_time))
+
+
+def bench_geocoding(num_locations, latency=0.01, max_workers=16):
+    """
+    Compare serial and concurrent geocoding with a local stub backend
+
+    Args:
+        num_locations: Number of city/state pairs to geocode
+        latency: Simulated seconds per request
+        max_workers: Concurrent requests for the concurrent run
+    Returns:
+        None, prints timings
+    """
+    data = make_synthetic_data(max(num_locations * 2, 5000))
+    pairs = list(data.groupby(['city', 'state']).groups.keys())[:num_locations]
+    serial, serial_time = timeit(GeocodingEngine(StubBackend(latency=latency, max_workers=1)).geocode_many, pairs)
+    concurrent, concurrent_time = timeit(GeocodingEngine(StubBackend(latency=latency, max_workers=max_workers)).geocode_many, pairs)
+    assert serial == concurrent
+    print("geocoding engine (%d locations, %.0f ms simulated latency)" % (len(pairs), latency * 1000))
+    print("  1 worker:   %8.3f s" % serial_time)
+    print("  %d workers: %8.3f s (%.0fx faster)" % (max_workers, concurrent_time, serial_time / concurrent_time))
+
+
+def bench_location_features(row_counts, reference_rows=10000):
+    """
+    Time the vectorized num_shootings/common_armed computation as the data grows
+
+    For inputs up to reference_rows the original loop is timed as well and both results
+    are checked to be identical.
+
+    Args:
+        row_counts: List of synthetic dataframe sizes
+        reference_rows: Largest size the original loop is run on
+    Returns:
+        None, prints timings
+    """
+    print("add_location_features")
+    for num_rows in row_counts:
+        data = make_synthetic_data(num_rows)
+        vectorized, vectorized_time = timeit(lambda frame: utils.add_location_features(frame) or frame, data.copy())
+        line = "  %9d rows: vectorized %8.3f s" % (num_rows, vectorized_time)
+        if num_rows <= reference_rows:
+            loop, loop_time = timeit(lambda frame: _add_location_features_loop(frame) or frame, data.copy())
+            pd.testing.assert_frame_equal(loop, vectorized, check_dtype=False)
+            line += ", loop %8.3f s (%.0fx faster)" % (loop_time, loop_time / vectorized_time)
+        print(line)
+
+
+def inflate(data, factor):
+    """
+    Make a bigger copy of the dataset by repeating it with new ids
+
+    Args:
+        data: Pandas dataframe of WaPo dataset
+        factor: How many copies of the data to stack
+    Returns:
+        Pandas dataframe with factor times as many rows
+    """
+    inflated = pd.concat([data] * factor, ignore_index=True)
+    inflated['id'] = np.arange(len(inflated), dtype=data['id'].dtype)
+    return inflated
+
+
+def measure(func, *args, repeat=1):
+    """
+    Measure wall time and peak traced memory of a function
+
+    Memory is measured with tracemalloc, which sees numpy and Python allocations but not
+    buffers allocated inside Arrow.
+
+    Args:
+        func: Function to call, it must not modify its arguments when repeat > 1
+        *args: Arguments passed to func
+        repeat: Number of timed calls, the fastest is reported
+    Returns:
+        Tuple of (return value, seconds, peak memory in MB)
+    """
+    times = []
+    for _ in range(repeat):
+        result, elapsed = timeit(func, *args)
+        times.append(elapsed)
+    tracemalloc.start()
+    # Timed functions reset the tracemalloc peak, TracedPeak keeps the whole call's peak
+    with TracedPeak() as peak:
+        func(*args)
+    tracemalloc.stop()
+    return result, min(times), peak.mb * 2 ** 20 / 1e6
+
+
+def pipeline_stages(workdir):
+    """
+    Stages of the preparation pipeline in the order DataPreparation.ipynb runs them
+
+    Each stage takes the output of the previous one and returns its own output without
+    modifying its input. Geocoding uses a local stub backend and a cache inside workdir.
+
+    Args:
+        workdir: Directory for the geocode cache and serialized data
+    Returns:
+        List of (name, function) tuples
+    """
+    cache_path = os.path.join(workdir, "geocode-cache.sqlite")
+    data_path = os.path.join(workdir, "data.feather")
+
+    def fix_city_names(data):
+        data = data.copy()
+        utils.fix_city_names(data)
+        return data
+
+    def get_coordinates_cold(data):
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+        return utils.get_coordinates(data.copy(), cache_path=cache_path, backend=StubBackend(),
+                                     gazetteer_path=None)
+
+    def get_coordinates_cached(data):
+        return utils.get_coordinates(data.copy(), cache_path=cache_path, offline=True, gazetteer_path=None)
+
+    def add_coordinates(data):
+        data = data.copy()
+        utils.add_coordinates(data)
+        return data
+
+    def fix_coordinates(data):
+        data = data.copy()
+        utils.fix_coordinates(data)
+        return data
+
+    def add_location_features(data):
+        data = data.copy()
+        utils.add_location_features(data)
+        return data
+
+    def serialize_data(data):
+        utils.serialize_data(data, data_path)
+        return data
+
+    def load_data(data):
+        return utils.load_data(data_path)
+
+    return [('fix_city_names', fix_city_names), ('get_coordinates_cold', get_coordinates_cold),
+            ('get_coordinates_cached', get_coordinates_cached), ('add_coordinates', add_coordinates),
+            ('fix_coordinates', fix_coordinates), ('add_location_features', add_location_features),
+            ('serialize_data', serialize_data), ('load_data', load_data)]
+
+
+def run_suite(scales, repeat=3):
+    """
+    Time every pipeline stage on the bundled CSV and on inflated copies of it
+
+    Args:
+        scales: List of inflation factors, 1 is the bundled CSV as is
+        repeat: Number of timed runs per stage, the fastest is reported
+    Returns:
+        Dictionary mapping "stage@scalex" to {"seconds": ..., "peak_mb": ..., "rows": ...}
+    """
+    results = {}
+    original = utils.read_data(CSV_PATH)
+    workdir = tempfile.mkdtemp()
+    try:
+        for scale in scales:
+            data = inflate(original, scale)
+            for name, stage in pipeline_stages(workdir):
+                data, seconds, peak_mb = measure(stage, data, repeat=repeat)
+                key = "%s@%dx" % (name, scale)
+                results[key] = {'seconds': seconds, 'peak_mb': peak_mb, 'rows': len(data)}
+                print("  %-32s %9d rows %9.3f s %9.1f MB" % (key, len(data), seconds, peak_mb))
+    finally:
+        shutil.rmtree(workdir)
+    return results
+
+
+# Code timed in a fresh interpreter by run_startup
+STARTUP_SNIPPETS = {
+    'import_store': "import store",
+    'import_utils': "import utils",
+    'open_lazy': "import store; len(store.load_data(lazy=True))",
+    'first_query_lazy': "import store; store.load_data(lazy=True)['state'].value_counts()",
+    'first_query_utils': "import utils; utils.load_data()['state'].value_counts()",
+}
+
+
+def run_startup(repeat=5):
+    """
+    Time cold imports and the first query of a fresh process
+
+    Every snippet runs in its own new interpreter so nothing is imported or cached yet,
+    the fastest of repeat runs is reported. Memory is the peak RSS of the interpreter (Linux only).
+
+    Args:
+        repeat: Number of fresh interpreters per snippet
+    Returns:
+        Dictionary mapping "snippet@startup" to {"seconds": ..., "peak_mb": ..., "rows": 0}
+        in the format of run_suite
+    """
+    # tracemalloc slows imports down several times, so memory is the process' peak RSS instead.
+    # VmHWM is used because ru_maxrss carries over the parent's peak through fork
+    template = ("import os, time\nstart = time.perf_counter()\n{code}\nseconds = time.perf_counter() - start\n"
+                "status = open('/proc/self/status').read().splitlines() if os.path.exists('/proc/self/status') else []\n"
+                "peak = [line.split()[1] for line in status if line.startswith('VmHWM')]\n"
+                "print(seconds, float(peak[0]) / 1024 if peak else 0.0)")
+    results = {}
+    for name, code in STARTUP_SNIPPETS.items():
+        runs = []
+        for _ in range(repeat):
+            output = subprocess.check_output([sys.executable, '-c', template.format(code=code)],
+                                             cwd=os.path.dirname(os.path.abspath(__file__)))
+            runs.append([float(value) for value in output.split()])
+        seconds, peak_mb = min(runs)
+        key = "%s@startup" % name
+        results[key] = {'seconds': seconds, 'peak_mb': peak_mb, 'rows': 0}
+        print("  %-32s %9.3f s %9.1f MB" % (key, seconds, peak_mb))
+    return results
+
+
+def find_regressions(results, baseline, threshold=0.25, min_seconds=0.05, min_mb=1.0):
+    """
+    Compare benchmark results against a saved baseline
+
+    A stage regressed if its time or peak memory grew by more than threshold. Stages
+    faster than min_seconds or smaller than min_mb are too noisy to compare.
+
+    Args:
+        results: Dictionary returned by run_suite
+        baseline: Dictionary returned by an earlier run_suite
+        threshold: Allowed relative increase, 0.25 is 25%
+        min_seconds: Ignore time changes when both runs are faster than this
+        min_mb: Ignore memory changes when both runs used less than this
+    Returns:
+        List of strings describing each regression
+    """
+    regressions = []
+    for key, result in sorted(results.items()):
+        if key not in baseline:
+            continue
+        for metric, floor in [('seconds', min_seconds), ('peak_mb', min_mb)]:
+            old, new = baseline[key][metric], result[metric]
+            if max(old, new) >= floor and new > old * (1 + threshold):
+                regressions.append("%s %s: %.3f -> %.3f (+%.0f%%)" % (key, metric, old, new, 100 * (new / old - 1)))
+    return regressions
+
+
+def check_missing_location_keys():
+    """
+    Rows with a missing city or state get NA location features instead of failing
+    """
+    data = make_synthetic_data(1000)
+    data['city'] = data['city'].astype(object)
+    data['state'] = data['state'].astype(object)
+    data.loc[[3, 500], 'city'] = np.nan
+    data.loc[[7], 'state'] = np.nan
+    utils.add_location_features(data)
+    missing = data['city'].isna() | data['state'].isna()
+    assert data['num_shootings'].isna().equals(missing)
+    assert data.loc[missing, 'common_armed'].isna().all()
+    complete = data.loc[~missing].copy()
+    expected = complete.groupby(['city', 'state'], observed=True)['id'].transform('size')
+    assert (complete['num_shootings'] == expected).all()
+
+
+def check_known_bad_coordinates():
+    """
+    validate.find_incorrect_coordinates flags every known geocoding error and no fixed location
+    """
+    import validate
+
+    data = utils.load_data()
+    bad = pd.read_csv(KNOWN_BAD_PATH)
+    pairs = pd.MultiIndex.from_arrays([data['city'].astype(object), data['state'].astype(object)])
+    positions = pd.MultiIndex.from_frame(bad[['city', 'state']]).get_indexer(pairs)
+    matched = positions >= 0
+    assert set(positions[matched]) == set(range(len(bad))), "some known bad locations aren't in the data"
+    flagged = validate.find_incorrect_coordinates(data)
+    assert not pd.MultiIndex.from_frame(flagged[['city', 'state']].astype(object)).isin(
+        pd.MultiIndex.from_frame(bad[['city', 'state']])).any(), "fixed locations flagged"
+    data.loc[matched, 'lat'] = bad['lat'].to_numpy()[positions[matched]]
+    data.loc[matched, 'lon'] = bad['lon'].to_numpy()[positions[matched]]
+    flagged = validate.find_incorrect_coordinates(data)
+    missed = bad.loc[~pd.MultiIndex.from_frame(bad[['city', 'state']]).isin(
+        pd.MultiIndex.from_frame(flagged[['city', 'state']].astype(object)))]
+    assert missed.empty, "%d of %d known bad locations missed: %s" % (
+        len(missed), len(bad), ", ".join("%s, %s" % pair for pair in zip(missed['city'], missed['state'])))
+
+
+def check_ingest_matches_refresh():
+    """
+    ingest.ingest writes the same rows as utils.refresh at any chunk size, rows with a
+    missing city or state included
+    """
+    import ingest
+
+    data = make_synthetic_data(1000)
+    data.loc[[3, 500], 'city'] = np.nan
+    data.loc[[7, 999], 'state'] = np.nan
+    temp_dir = tempfile.mkdtemp()
+    try:
+        csv_path = os.path.join(temp_dir, "data.csv")
+        data.to_csv(csv_path, index=False)
+        options = dict(cache_path=os.path.join(temp_dir, "geocode-cache.sqlite"), backend=StubBackend(),
+                       gazetteer_path=None)
+        expected_path = os.path.join(temp_dir, "refresh.feather")
+        utils.refresh(csv_path, expected_path, **options)
+        expected = utils.load_data(expected_path)
+        assert expected['num_shootings'].isna().sum() == 4
+        for chunk_size in [7, 500, 100000]:
+            path = os.path.join(temp_dir, "ingest-%d.feather" % chunk_size)
+            ingest.ingest([csv_path], path, chunk_size=chunk_size, **options)
+            pd.testing.assert_frame_equal(utils.load_data(path), expected, check_categorical=False,
+                                          obj="ingest with chunk_size=%d" % chunk_size)
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+CHECKS = [check_missing_location_keys, check_known_bad_coordinates, check_ingest_matches_refresh]
+
+
+def run_checks():
+    failed = 0
+    for check in CHECKS:
+        try:
+            check()
+        except Exception as e:
+            failed += 1
+            print("FAIL", check.__name__, repr(e))
+        else:
+            print("ok  ", check.__name__)
+    return failed
+
+
+def run_micro(args):
+    bench_assign_coordinates(args.rows)
+    bench_geocoding(args.locations)
+    bench_location_features(args.feature_rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('which', nargs='?', choices=['suite', 'micro', 'startup', 'check'], default='suite',
+                        help="Pipeline suite, old vs new implementation comparisons, cold start times or "
+                        "correctness checks")
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100], help="Inflation factors for suite")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per stage in suite")
+    parser.add_argument('--save', help="Save suite or startup results to this JSON file")
+    parser.add_argument('--baseline', help="Compare suite or startup results with this JSON file")
+    parser.add_argument('--threshold', type=float, default=0.25, help="Allowed relative slowdown before failing")
+    parser.add_argument('--rows', type=int, default=100000, help="Rows in synthetic dataframe")
+    parser.add_argument('--locations', type=int, default=500, help="Locations to geocode with stub backend")
+    parser.add_argument('--feature-rows', type=int, nargs='+', default=[4000, 100000, 1000000, 5000000],
+                        help="Synthetic dataframe sizes for add_location_features")
+    args = parser.parse_args()
+    if args.which == 'micro':
+        run_micro(args)
+        sys.exit(0)
+    if args.which == 'check':
+        sys.exit(1 if run_checks() else 0)
+
+    if args.which == 'startup':
+        print("startup")
+        results = run_startup(repeat=args.repeat)
+    else:
+        print("pipeline suite")
+        results = run_suite(args.scales, repeat=args.repeat)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), threshold=args.threshold)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        sys.exit(1 if regressions else 0)
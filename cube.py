@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pandas as pd
+import store
+
+# signs_of_mental_illness is included so the mental-illness-armed plot can come from the cube too
+CUBE_DIMENSIONS = ['year', 'month', 'state', 'race', 'gender', 'armed', 'flee', 'body_camera',
+                   'signs_of_mental_illness']
+CUBE_MEASURES = ['count', 'age_count', 'age_sum', 'age_sumsq', 'age_min', 'age_max']
+# How each measure combines when rolling up
+ROLLUP_FUNCTIONS = {'count': 'sum', 'age_count': 'sum', 'age_sum': 'sum', 'age_sumsq': 'sum',
+                    'age_min': 'min', 'age_max': 'max'}
+
+
+def cube_path_for(data_path):
+    """
+    Path of the cached cube that belongs to a data file
+
+    Args:
+        data_path: Path to Feather file written by utils.serialize_data
+    Returns:
+        Path next to the data file, e.g. data.feather -> data-cube.feather
+    """
+    return store.cache_path_for(data_path, "-cube.feather")
+
+
+def build_cube(data):
+    """
+    Aggregate the row level data over every combination of the cube dimensions
+
+    Missing dimension values are kept as their own group. Age statistics are stored as
+    sums so they can be rolled up exactly (see rollup).
+
+    Args:
+        data: Pandas dataframe of WaPo dataset
+    Returns:
+        Dataframe with one row per observed combination of CUBE_DIMENSIONS and the
+        count, age_count, age_sum, age_sumsq, age_min and age_max columns
+    """
+    date = pd.to_datetime(data['date'])
+    age = data['age'].astype(float)
+    frame = pd.DataFrame({'year': date.dt.year.astype('int16'), 'month': date.dt.month.astype('int8')})
+    for dimension in CUBE_DIMENSIONS[2:]:
+        frame[dimension] = data[dimension].astype('category')
+    frame['age'] = age
+    frame['age_known'] = age.notna()
+    frame['age_sum'] = age.fillna(0)
+    frame['age_sumsq'] = age.fillna(0) ** 2
+    cube = frame.groupby(CUBE_DIMENSIONS, observed=True, dropna=False).agg(
+        count=('age_known', 'size'), age_count=('age_known', 'sum'), age_sum=('age_sum', 'sum'),
+        age_sumsq=('age_sumsq', 'sum'), age_min=('age', 'min'), age_max=('age', 'max'))
+    return cube.reset_index()
+
+
+def load_cube(data_path=store.DATA_PATH, rebuild=False):
+    """
+    Load the cube for a data file, building and caching it if the data changed
+
+    The cube is saved next to the data file together with the hash of the data it was built
+    from, so it is rebuilt automatically whenever the data file is rewritten.
+
+    Args:
+        data_path: Path to Feather file written by utils.serialize_data
+        rebuild: If True ignore the cached cube
+    Returns:
+        Cube dataframe, see build_cube
+    """
+    return store.load_cached(data_path, "-cube.feather", lambda: build_cube(store.load_data(data_path)),
+                             rebuild=rebuild)
+
+
+def rollup(cube, by=(), **filters):
+    """
+    Slice the cube and aggregate it over a subset of its dimensions
+
+    Example: rollup(cube, ['year', 'race'], state=['CA', 'TX'], armed='unarmed')
+
+    Args:
+        cube: Cube dataframe from build_cube or load_cube
+        by: Dimensions to keep, the rest are summed over. Empty for grand totals
+        **filters: Dimension name to a single value or list of values to keep
+    Returns:
+        Dataframe with the by dimensions and count, age_count, age_mean, age_std,
+        age_min and age_max columns
+    """
+    mask = np.ones(len(cube), dtype=bool)
+    for dimension, values in filters.items():
+        if dimension not in CUBE_DIMENSIONS:
+            raise ValueError("Unknown cube dimension: %s" % dimension)
+        if not isinstance(values, (list, tuple, set)):
+            values = [values]
+        mask &= cube[dimension].isin(values).to_numpy()
+    sliced = cube.loc[mask]
+    by = list(by)
+    if by:
+        grouped = sliced.groupby(by, observed=True, dropna=False)[CUBE_MEASURES].agg(ROLLUP_FUNCTIONS).reset_index()
+    else:
+        grouped = sliced[CUBE_MEASURES].agg(ROLLUP_FUNCTIONS).to_frame().T
+        grouped[['count', 'age_count']] = grouped[['count', 'age_count']].astype(int)
+    age_count = grouped['age_count'].astype(float).replace(0, np.nan)
+    grouped['age_mean'] = grouped['age_sum'] / age_count
+    # Sample standard deviation from the sum of squares
+    variance = (grouped['age_sumsq'] - age_count * grouped['age_mean'] ** 2) / (age_count - 1)
+    grouped['age_std'] = np.sqrt(variance.clip(lower=0))
+    return grouped[by + ['count', 'age_count', 'age_mean', 'age_std', 'age_min', 'age_max']]
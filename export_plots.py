@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+
+"""
+Render the figures in plots/ as PNG files without a notebook
+
+Run with: python export_plots.py
+Only figures whose input data or figure code changed since the last export are
+re-rendered, use --force to render everything. Needs plotly and kaleido.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+import utils
+from store import code_source
+
+PLOTS_DIR = "plots"
+FINGERPRINTS_FILE = "fingerprints.json"
+WIDTH = 800
+HEIGHT = 600
+
+RACE_NAMES = {'W': 'White', 'B': 'Black', 'H': 'Hispanic', 'A': 'Asian', 'N': 'Native American', 'O': 'Other'}
+
+
+def _bar(x, y, color, text=None):
+    return dict(type='bar', x=list(x), y=[int(value) for value in y], text=text, textposition='auto',
+                marker=dict(color=color, line=dict(color='rgb(8, 48, 107)', width=1.5)), opacity=0.6)
+
+
+def _layout(title, xaxis_title, yaxis_title="Number of shootings", **kwargs):
+    return dict(title=dict(text=title, x=0.5), xaxis=dict(title=xaxis_title, tickangle=kwargs.pop('tickangle', 0)),
+                yaxis=dict(title=yaxis_title), template='plotly_white', **kwargs)
+
+
+def _distribution(series, title, xaxis_title, color, names=None):
+    counts = series.map(names).fillna("Missing Data") if names else series.fillna("Missing Data")
+    counts = counts.value_counts()
+    return dict(data=[_bar(counts.index, counts.values, color, text=[str(value) for value in counts.values])],
+                layout=_layout(title, xaxis_title))
+
+
+def race_distribution(data):
+    return _distribution(data['race'].astype(object), "Race distribution", "Race", 'rgb(158, 202, 225)', RACE_NAMES)
+
+
+def gender_distribution(data):
+    return _distribution(data['gender'].astype(object).map({'M': 'Male', 'F': 'Female'}),
+                         "Gender distribution", "Gender", 'rgb(255, 153, 204)')
+
+
+def manner_death_distribution(data):
+    return _distribution(data['manner_of_death'].astype(object), "Manner of death distribution",
+                         "Manner of death", 'rgb(244, 140, 36)')
+
+
+def flee_distribution(data):
+    return _distribution(data['flee'].astype(object), "Flee distribution", "Flee", 'rgb(102, 194, 165)')
+
+
+def num_shootings_per_state(data):
+    counts = data['state'].astype(object).value_counts()
+    return dict(data=[_bar(counts.index, counts.values, 'rgb(153, 51, 255)')],
+                layout=_layout("Number of shootings per state", "State", tickangle=-45))
+
+
+def race_time(data):
+    date = pd.to_datetime(data['date'])
+    months = date.dt.to_period('M')
+    counts = pd.crosstab(months, data['race'].astype(object)).reindex(columns=list(RACE_NAMES), fill_value=0)
+    labels = ["%d/%d" % (period.month, period.year) for period in counts.index]
+    traces = [dict(type='scatter', mode='lines+markers', x=labels, y=[int(value) for value in counts[race]],
+                   name=name, line=dict(width=4)) for race, name in RACE_NAMES.items()]
+    return dict(data=traces, layout=_layout("Race over time", "Time", tickangle=-45))
+
+
+def age_vs_race(data):
+    known = data.dropna(subset=['age', 'race'])
+    trace = dict(type='scatter', mode='markers', x=known['age'].astype(float).tolist(),
+                 y=known['race'].astype(object).map(RACE_NAMES).tolist(),
+                 marker=dict(size=12, color='rgb(0, 0, 255)', opacity=0.3))
+    return dict(data=[trace], layout=_layout("Age vs. Race", "Age", yaxis_title=""))
+
+
+def mental_illness_armed(data):
+    mental_illness = data['signs_of_mental_illness'].astype(bool)
+    armed = data.loc[mental_illness, 'armed'].astype(object).value_counts()
+    totals = [int(mental_illness.sum()), int((~mental_illness).sum())]
+    weapons = _bar(armed.index, armed.values, 'rgb(158, 202, 225)')
+    weapons['name'] = "Weapon distribution for people showing signs of mental illness"
+    distribution = _bar(["Signs of mental illness", "No signs of mental illness"], totals, 'rgb(0, 179, 179)',
+                        text=[str(total) for total in totals])
+    distribution.update(name="Distribution of people showing signs of mental illness", xaxis='x2', yaxis='y2')
+    layout = _layout("Common weapon for people showing signs of mental illness", "", tickangle=-45,
+                     legend=dict(x=0.5, y=0.3), xaxis2=dict(domain=[0.5, 0.95], anchor='y2'), yaxis2=dict(domain=[0.6, 0.95], anchor='x2'))
+    return dict(data=[weapons, distribution], layout=layout)
+
+
+def cities_bodycam(data, num_cities=5):
+    bodycam = data.loc[data['body_camera'].astype(bool)]
+    counts = bodycam.groupby(['city', 'state'], observed=True).size().sort_values(ascending=False)[:num_cities]
+    cities = [city for city, _ in counts.index]
+    states = [state for _, state in counts.index]
+    return dict(data=[_bar(cities, counts.values, 'rgb(133, 214, 69)', text=states)],
+                layout=_layout("Cities with most bodycam shootings", "Cities", tickangle=-45))
+
+
+# Shared spec code every figure is drawn with
+COMMON_CODE = [_bar, _layout]
+DISTRIBUTION_CODE = COMMON_CODE + [_distribution]
+
+# Figure name (PNG file name in plots/) -> (columns the figure uses, function building it,
+# helpers and constants the function uses)
+FIGURES = {
+    'race-distribution': (['race'], race_distribution, DISTRIBUTION_CODE + [RACE_NAMES]),
+    'gender-distribution': (['gender'], gender_distribution, DISTRIBUTION_CODE),
+    'manner-death-distribution': (['manner_of_death'], manner_death_distribution, DISTRIBUTION_CODE),
+    'flee-distribution': (['flee'], flee_distribution, DISTRIBUTION_CODE),
+    'num-shootings-per-state': (['state'], num_shootings_per_state, COMMON_CODE),
+    'race-time': (['date', 'race'], race_time, COMMON_CODE + [RACE_NAMES]),
+    'age-vs-race': (['age', 'race'], age_vs_race, COMMON_CODE + [RACE_NAMES]),
+    'mental-illness-armed': (['signs_of_mental_illness', 'armed'], mental_illness_armed, COMMON_CODE),
+    'cities-bodycam': (['city', 'state', 'body_camera'], cities_bodycam, COMMON_CODE),
+}
+
+
+def fingerprint(name, data):
+    """
+    Hash of a figure's input columns plus the code that builds it
+
+    Args:
+        name: Figure name in FIGURES
+        data: Pandas dataframe of WaPo dataset
+    Returns:
+        Hex digest that changes when either the figure's data or its spec (the figure
+        function or any helper or constant it uses) changes
+    """
+    columns, build, code = FIGURES[name]
+    sha1 = hashlib.sha1()
+    sha1.update(pd.util.hash_pandas_object(data[columns].astype(object), index=False).to_numpy().tobytes())
+    for item in [build] + code:
+        sha1.update(code_source(item).encode('utf-8'))
+    sha1.update(("%dx%d" % (WIDTH, HEIGHT)).encode('utf-8'))
+    return sha1.hexdigest()
+
+
+def render(name, data, path):
+    """
+    Build a figure and write it to a PNG file, runs in a worker process
+
+    Args:
+        name: Figure name in FIGURES
+        data: The figure's input columns
+        path: Where to write the PNG
+    Returns:
+        Figure name
+    """
+    import plotly.io as pio
+
+    figure = FIGURES[name][1](data)
+    pio.write_image(figure, path, format='png', width=WIDTH, height=HEIGHT)
+    return name
+
+
+def export_plots(data=None, plots_dir=PLOTS_DIR, names=None, force=False, workers=None):
+    """
+    Render figures that are out of date in a process pool
+
+    Args:
+        data: Pandas dataframe of WaPo dataset, loaded with utils.load_data if None
+        plots_dir: Directory with the PNG files and their fingerprints
+        names: Figures to consider, all of FIGURES if None
+        force: If True render every figure even if it is up to date
+        workers: Number of processes, defaults to the number of CPUs
+    Returns:
+        List of figure names that were rendered
+    """
+    if data is None:
+        data = utils.load_data()
+    fingerprints_path = os.path.join(plots_dir, FINGERPRINTS_FILE)
+    fingerprints = {}
+    if os.path.exists(fingerprints_path):
+        with open(fingerprints_path) as f:
+            fingerprints = json.load(f)
+
+    stale = {}
+    for name in names or FIGURES:
+        path = os.path.join(plots_dir, name + ".png")
+        current = fingerprint(name, data)
+        if force or fingerprints.get(name) != current or not os.path.exists(path):
+            stale[name] = current
+    if not stale:
+        return []
+
+    rendered = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(render, name, data[FIGURES[name][0]], os.path.join(plots_dir, name + ".png")): name
+                   for name in stale}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print("Error rendering", name, e)
+                continue
+            fingerprints[name] = stale[name]
+            rendered.append(name)
+    with open(fingerprints_path, 'w') as f:
+        json.dump(fingerprints, f, indent=2, sort_keys=True)
+    return rendered
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('names', nargs='*', help="Figures to export, all if empty: %s" % ", ".join(FIGURES))
+    parser.add_argument('--data', default=utils.DATA_PATH, help="Prepared dataset written by utils.serialize_data")
+    parser.add_argument('--plots-dir', default=PLOTS_DIR, help="Output directory")
+    parser.add_argument('--force', action='store_true', help="Render figures even if they are up to date")
+    parser.add_argument('--workers', type=int, help="Number of worker processes")
+    args = parser.parse_args()
+    unknown = set(args.names) - set(FIGURES)
+    if unknown:
+        parser.error("unknown figure(s): %s" % ", ".join(sorted(unknown)))
+    rendered = export_plots(utils.load_data(args.data), args.plots_dir, args.names or None, args.force, args.workers)
+    print("Rendered %d figure(s) %s" % (len(rendered), ", ".join(sorted(rendered))))
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+import difflib
+import re
+import numpy as np
+import pandas as pd
+from geocoding import Backend
+
+GAZETTEER_PATH = "gazetteer-places.npz"
+
+# Legal/statistical area descriptions appended to Census place names ("Aloha CDP", "Wichita city")
+PLACE_SUFFIX = re.compile(r"\s+(city and borough|unified government|metropolitan government|"
+                          r"metro government|consolidated government|urban county|city|town|village|"
+                          r"borough|cdp|municipality|plantation|corporation|comunidad|zona urbana)"
+                          r"(\s*\(balance\))?$")
+ABBREVIATIONS = [(re.compile(r"^st\.?\s"), "saint "), (re.compile(r"^ste\.?\s"), "sainte "),
+                 (re.compile(r"^ft\.?\s"), "fort "), (re.compile(r"^mt\.?\s"), "mount ")]
+
+
+def normalize_place(name, strip_suffix=False):
+    """
+    Normalize a place name so spellings from different sources compare equal
+
+    Args:
+        name: Place name, e.g. "St. Petersburg" or "Aloha CDP"
+        strip_suffix: If True remove Census area descriptions like "city" or "CDP"
+    Returns:
+        Lowercase name with expanded abbreviations and collapsed whitespace
+    """
+    name = " ".join(str(name).lower().replace("'", "").replace("-", " ").split())
+    if strip_suffix:
+        name = PLACE_SUFFIX.sub("", name)
+        # Drop any other text in parentheses
+        name = re.sub(r"\s*\(.*\)$", "", name)
+    for pattern, replacement in ABBREVIATIONS:
+        name = pattern.sub(replacement, name)
+    return name
+
+
+class GazetteerBackend(Backend):
+    """
+    Offline geocoder that looks up places in a local copy of the Census gazetteer files
+
+    Places are stored in sorted numpy arrays keyed by "ST|normalized name" so exact lookups
+    are a binary search. Names that aren't found exactly can fall back to the closest spelling
+    within the same state that starts with the same letter, which catches typos like
+    "Jacksonsville" or "Joilet". Distinct towns can be that close too (Salem/Salen,
+    Aloha/Alpha), so get_coordinates only uses fuzzy matches for pairs the cache and
+    Nominatim couldn't resolve.
+
+    Args:
+        path: Index built with GazetteerBackend.build (.npz)
+        cutoff: Minimum similarity (0-1) for a fuzzy match, None disables fuzzy matching
+    """
+    rate_limit = None
+    max_workers = 1
+
+    def __init__(self, path=GAZETTEER_PATH, cutoff=0.8):
+        with np.load(path, allow_pickle=False) as index:
+            self.keys = index['keys']
+            self.lat = index['lat']
+            self.lon = index['lon']
+        self.cutoff = cutoff
+        # Names of every place in each state, used for fuzzy matching
+        states = np.array([key.split("|", 1)[0] for key in self.keys])
+        bounds = np.flatnonzero(np.r_[True, states[1:] != states[:-1], True])
+        self.state_slices = {states[start]: slice(start, end) for start, end in zip(bounds[:-1], bounds[1:])}
+        self.fuzzy_cache = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    @staticmethod
+    def build(gazetteer_paths, path=GAZETTEER_PATH):
+        """
+        Build the index from Census gazetteer text files
+
+        Files can be downloaded from https://www.census.gov/geographies/reference-files/time-series/geo/gazetteer-files.html.
+        The places file covers cities, towns and CDPs and the county subdivisions file adds
+        townships. Every place is indexed by its name without the legal description ("Wichita city"
+        -> "wichita") and by its full name, since some names end in a word that looks like one
+        but isn't ("Carson City"). When a name appears more than once in a state the stripped
+        name wins over a full name, then the largest by land area is kept.
+
+        Args:
+            gazetteer_paths: Path or list of paths to tab separated gazetteer files
+            path: Where to save the index
+        Returns:
+            Number of names in the index
+        """
+        if isinstance(gazetteer_paths, str):
+            gazetteer_paths = [gazetteer_paths]
+        frames = []
+        for gazetteer_path in gazetteer_paths:
+            frame = pd.read_csv(gazetteer_path, sep="\t", dtype=str)
+            frame.columns = frame.columns.str.strip()
+            frames.append(frame[['USPS', 'NAME', 'ALAND', 'INTPTLAT', 'INTPTLONG']])
+        places = pd.concat(frames, ignore_index=True)
+        places['ALAND'] = pd.to_numeric(places['ALAND'])
+        states = places['USPS'].str.strip() + "|"
+        stripped = places['NAME'].map(lambda name: normalize_place(name, strip_suffix=True))
+        stripped = places.assign(key=states + stripped, full_name=False)
+        full = places.assign(key=states + places['NAME'].map(normalize_place), full_name=True)
+        places = pd.concat([stripped, full], ignore_index=True)
+        places = places.sort_values(['key', 'full_name', 'ALAND'], ascending=[True, True, False])
+        places = places.drop_duplicates('key')
+        np.savez_compressed(path, keys=places['key'].to_numpy(dtype=str),
+                            lat=pd.to_numeric(places['INTPTLAT']).to_numpy(dtype=float),
+                            lon=pd.to_numeric(places['INTPTLONG']).to_numpy(dtype=float))
+        return len(places)
+
+    def _fuzzy(self, city, state):
+        """
+        Find the position of the closest spelling of a place within its state, -1 if none
+        """
+        pair = (city, state)
+        if pair not in self.fuzzy_cache:
+            position = -1
+            if self.cutoff is not None and state in self.state_slices:
+                state_slice = self.state_slices[state]
+                name = normalize_place(city)
+                names = [key.split("|", 1)[1] for key in self.keys[state_slice]]
+                # Misspellings rarely get the first letter wrong, different towns often do (Dayton/Layton)
+                candidates = [candidate for candidate in names if candidate[:1] == name[:1]]
+                matches = difflib.get_close_matches(name, candidates, n=1, cutoff=self.cutoff)
+                if matches:
+                    position = state_slice.start + names.index(matches[0])
+            self.fuzzy_cache[pair] = position
+        return self.fuzzy_cache[pair]
+
+    def lookup_many(self, cities, states, fuzzy=True):
+        """
+        Vectorized lookup of many city/state pairs
+
+        Args:
+            cities: Sequence of city names
+            states: Sequence of state abbreviations
+            fuzzy: If False only exact (normalized) names are matched
+        Returns:
+            Tuple of latitude and longitude arrays, NaN where a pair wasn't found
+        """
+        cities = list(cities)
+        states = list(states)
+        queries = np.array(["%s|%s" % (state, normalize_place(city)) for city, state in zip(cities, states)], dtype=str)
+        positions = np.searchsorted(self.keys, queries)
+        positions[positions == len(self.keys)] = 0
+        positions[self.keys[positions] != queries] = -1
+        if fuzzy:
+            for i in np.flatnonzero(positions < 0):
+                positions[i] = self._fuzzy(cities[i], states[i])
+        # Trailing NaN is picked up by the -1 positions
+        lat = np.append(self.lat, np.nan)[positions]
+        lon = np.append(self.lon, np.nan)[positions]
+        return lat, lon
+
+    def geocode(self, city, state):
+        lat, lon = self.lookup_many([city], [state])
+        if np.isnan(lat[0]):
+            return None
+        return (float(lat[0]), float(lon[0]))
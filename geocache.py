@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+import sqlite3
+import time
+import numpy as np
+from instrument import METRICS
+
+GEOCODE_CACHE_PATH = "geocode-cache.sqlite"
+QUERY_BATCH_SIZE = 500
+
+
+def normalize_key(city, state):
+    """
+    Build the cache key for a city/state pair
+
+    Args:
+        city: City name as it appears in the dataset
+        state: State abbreviation (CA, TX, etc)
+    Returns:
+        String of the form "city, ST" with collapsed whitespace and lowercase city
+    """
+    return "%s, %s" % (" ".join(str(city).split()).lower(), str(state).strip().upper())
+
+
+class GeocodeCache(object):
+    """
+    Persistent on-disk store of geocoding results keyed by normalized "city, state"
+
+    Both hits (lat/lon found) and misses (geocoder returned nothing) are recorded
+    together with the time they were fetched so a refresh only has to send requests
+    for locations that have never been seen. If max_age (in seconds) is given then
+    entries older than that are treated as unseen and will be geocoded again.
+    """
+
+    def __init__(self, path=GEOCODE_CACHE_PATH, max_age=None):
+        self.path = path
+        self.max_age = max_age
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS geocodes (
+                                 key TEXT PRIMARY KEY,
+                                 city TEXT NOT NULL,
+                                 state TEXT NOT NULL,
+                                 lat REAL,
+                                 lon REAL,
+                                 found INTEGER NOT NULL,
+                                 fetched_at REAL NOT NULL)""")
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM geocodes").fetchone()[0]
+
+    def _is_fresh(self, fetched_at):
+        return self.max_age is None or time.time() - fetched_at <= self.max_age
+
+    def get(self, city, state):
+        """
+        Look up a city/state pair
+
+        Args:
+            city: City name
+            state: State abbreviation
+        Returns:
+            None if the pair was never seen (or has expired), otherwise a
+            (lat, lon) tuple which is (NaN, NaN) for a recorded miss
+        """
+        row = self.conn.execute("SELECT lat, lon, found, fetched_at FROM geocodes WHERE key = ?",
+                                (normalize_key(city, state),)).fetchone()
+        if row is None or not self._is_fresh(row[3]):
+            METRICS.count('geocode_cache_misses_total')
+            return None
+        METRICS.count('geocode_cache_hits_total')
+        if not row[2]:
+            return (np.nan, np.nan)
+        return (row[0], row[1])
+
+    def get_many(self, pairs):
+        """
+        Look up several city/state pairs with a single query
+
+        Args:
+            pairs: Iterable of (city, state) tuples
+        Returns:
+            Dictionary mapping each (city, state) found in the cache to (lat, lon).
+            Pairs that were never seen or have expired are left out
+        """
+        # Several spellings of a pair (e.g. different capitalization) can share one key
+        keys = {}
+        for city, state in pairs:
+            keys.setdefault(normalize_key(city, state), []).append((city, state))
+        found = {}
+        unique_keys = list(keys)
+        # Older SQLite builds allow at most 999 parameters per statement
+        for start in range(0, len(unique_keys), QUERY_BATCH_SIZE):
+            batch = unique_keys[start:start + QUERY_BATCH_SIZE]
+            cursor = self.conn.execute("SELECT key, lat, lon, found, fetched_at FROM geocodes WHERE key IN (%s)" %
+                                       ", ".join("?" * len(batch)), batch)
+            for key, lat, lon, hit, fetched_at in cursor:
+                if self._is_fresh(fetched_at):
+                    for pair in keys[key]:
+                        found[pair] = (lat, lon) if hit else (np.nan, np.nan)
+        METRICS.count('geocode_cache_hits_total', len(found))
+        METRICS.count('geocode_cache_misses_total', sum(len(group) for group in keys.values()) - len(found))
+        return found
+
+    def put(self, city, state, latitude, longitude):
+        """
+        Record a geocoding result. NaN/None coordinates are stored as a miss
+
+        Args:
+            city: City name
+            state: State abbreviation
+            latitude: Latitude value or NaN if location couldn't be geocoded
+            longitude: Longitude value or NaN if location couldn't be geocoded
+        Returns:
+            None
+        """
+        found = latitude is not None and longitude is not None and \
+            not (np.isnan(latitude) or np.isnan(longitude))
+        self.conn.execute("INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                          (normalize_key(city, state), city, state,
+                           float(latitude) if found else None,
+                           float(longitude) if found else None,
+                           int(found), time.time()))
+        self.conn.commit()
+
+    def misses(self):
+        """
+        List every city/state pair recorded as a miss
+
+        Args:
+            None
+        Returns:
+            List of (city, state) tuples that the geocoder could not find
+        """
+        return self.conn.execute("SELECT city, state FROM geocodes WHERE found = 0 ORDER BY key").fetchall()
+
+    def close(self):
+        self.conn.close()
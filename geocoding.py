@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import random
+import threading
+import time
+import zlib
+from instrument import METRICS
+
+
+class TransientGeocodeError(Exception):
+    """
+    Raised by backends for failures worth retrying (timeouts, service unavailable)
+    """
+    pass
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket that limits how many requests are sent per second
+
+    Args:
+        rate: Tokens added per second
+        capacity: Maximum number of tokens that can be saved up for a burst
+    """
+
+    def __init__(self, rate, capacity=1.0):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a token is available and take it
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Backend(object):
+    """
+    Interface for geocoding backends
+
+    Subclasses implement geocode() and set rate_limit (max requests per second,
+    None for unlimited) and max_workers (how many requests may be in flight at once).
+    """
+    rate_limit = None
+    max_workers = 1
+
+    def geocode(self, city, state):
+        """
+        Geocode a single city/state pair
+
+        Args:
+            city: City name
+            state: State abbreviation (CA, TX, etc)
+        Returns:
+            (lat, lon) tuple or None if the location could not be found
+        Raises:
+            TransientGeocodeError: if the request failed but may succeed when retried
+        """
+        raise NotImplementedError
+
+
+class NominatimBackend(Backend):
+    """
+    Geocode with a Nominatim server, the public one by default
+
+    The public server allows at most 1 request per second from a single client, pass a
+    higher rate_limit and max_workers when using a self-hosted instance.
+
+    Args:
+        state_names: Dictionary mapping state abbreviations to full names
+        user_agent: User agent sent with every request
+        domain: Nominatim server domain, None for nominatim.openstreetmap.org
+        scheme: "https" or "http", None for geopy's default
+        timeout: Seconds to wait for a response
+        rate_limit: Max requests per second, None for unlimited
+        max_workers: Max concurrent requests
+    """
+
+    def __init__(self, state_names, user_agent="my-application", domain=None, scheme=None,
+                 timeout=5, rate_limit=1.0, max_workers=1):
+        # Imported here so the rest of the engine works without geopy installed
+        from geopy.geocoders import Nominatim
+        from geopy import exc
+
+        kwargs = {'user_agent': user_agent}
+        if domain is not None:
+            kwargs['domain'] = domain
+        if scheme is not None:
+            kwargs['scheme'] = scheme
+        self.geolocator = Nominatim(**kwargs)
+        self.transient_errors = (exc.GeocoderTimedOut, exc.GeocoderUnavailable)
+        self.state_names = state_names
+        self.timeout = timeout
+        self.rate_limit = rate_limit
+        self.max_workers = max_workers
+
+    def geocode(self, city, state):
+        # Restrict geocoding to recognize locations ONLY in USA
+        query = "%s, %s, United States of America" % (city, self.state_names[state])
+        try:
+            location = self.geolocator.geocode(query, timeout=self.timeout)
+        except self.transient_errors as e:
+            raise TransientGeocodeError(str(e))
+        if location is None:
+            return None
+        _, (latitude, longitude) = location
+        return (latitude, longitude)
+
+
+class StubBackend(Backend):
+    """
+    Local backend for testing and benchmarking the engine without network access
+
+    Args:
+        coordinates: Dictionary mapping (city, state) to (lat, lon). Pairs not in it are
+            not found. If None every pair gets deterministic fake US coordinates
+        latency: Seconds each request takes
+        failures: Dictionary mapping (city, state) to how many times a request for
+            it raises TransientGeocodeError before succeeding
+        rate_limit: Max requests per second, None for unlimited
+        max_workers: Max concurrent requests
+    """
+
+    def __init__(self, coordinates=None, latency=0.0, failures=None, rate_limit=None, max_workers=8):
+        self.coordinates = coordinates
+        self.latency = latency
+        self.failures = dict(failures or {})
+        self.rate_limit = rate_limit
+        self.max_workers = max_workers
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def geocode(self, city, state):
+        with self.lock:
+            self.requests += 1
+            failures = self.failures.get((city, state), 0)
+            if failures:
+                self.failures[(city, state)] = failures - 1
+        if self.latency:
+            time.sleep(self.latency)
+        if failures:
+            raise TransientGeocodeError("Simulated timeout for %s, %s" % (city, state))
+        if self.coordinates is None:
+            seed = zlib.crc32(("%s, %s" % (city, state)).encode('utf-8'))
+            return (25 + (seed % 2400) / 100.0, -124 + ((seed // 2400) % 5700) / 100.0)
+        return self.coordinates.get((city, state))
+
+
+class GeocodingEngine(object):
+    """
+    Geocode many city/state pairs with a backend, respecting its rate limit and concurrency
+
+    Requests that raise TransientGeocodeError are retried with exponential backoff and jitter.
+
+    Args:
+        backend: Backend instance
+        retries: Number of retries after the first failed attempt
+        backoff: Seconds to wait before the first retry, doubled for every retry after that
+        max_backoff: Upper bound on the wait between retries
+    """
+
+    def __init__(self, backend, retries=3, backoff=1.0, max_backoff=30.0):
+        self.backend = backend
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.bucket = TokenBucket(backend.rate_limit) if backend.rate_limit else None
+
+    def geocode(self, city, state):
+        """
+        Geocode a single pair, retrying transient failures
+
+        Args:
+            city: City name
+            state: State abbreviation
+        Returns:
+            (lat, lon) tuple or None if the location could not be found
+        Raises:
+            TransientGeocodeError: if every attempt failed
+        """
+        for attempt in range(self.retries + 1):
+            if self.bucket is not None:
+                start = time.perf_counter()
+                self.bucket.acquire()
+                METRICS.observe('geocode_throttle_wait_seconds', time.perf_counter() - start)
+            METRICS.count('geocode_requests_total')
+            start = time.perf_counter()
+            try:
+                location = self.backend.geocode(city, state)
+            except TransientGeocodeError:
+                METRICS.observe('geocode_request_seconds', time.perf_counter() - start)
+                METRICS.count('geocode_failures_total', kind='transient')
+                if attempt == self.retries:
+                    raise
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+                METRICS.count('geocode_backoff_seconds_total', delay)
+                time.sleep(delay)
+                continue
+            except Exception:
+                METRICS.count('geocode_failures_total', kind='error')
+                raise
+            METRICS.observe('geocode_request_seconds', time.perf_counter() - start)
+            METRICS.count('geocode_results_total', result='found' if location is not None else 'not_found')
+            return location
+
+    def geocode_iter(self, pairs):
+        """
+        Geocode city/state pairs concurrently, yielding results as they complete
+
+        Results are yielded in the calling thread so callers can safely write them
+        to a cache or database as they come in.
+
+        Args:
+            pairs: Iterable of (city, state) tuples
+        Yields:
+            ((city, state), location, error) tuples where location is (lat, lon) or None
+            and error is the exception raised if the request failed, otherwise None
+        """
+        pairs = list(pairs)
+        with ThreadPoolExecutor(max_workers=max(1, self.backend.max_workers)) as executor:
+            futures = {executor.submit(self.geocode, city, state): (city, state) for city, state in pairs}
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result(), None
+                except Exception as e:
+                    yield futures[future], None, e
+
+    def geocode_many(self, pairs):
+        """
+        Geocode city/state pairs concurrently
+
+        Args:
+            pairs: Iterable of (city, state) tuples
+        Returns:
+            Tuple of two dictionaries keyed by (city, state): locations, mapping to
+            (lat, lon) or None if not found, and errors, mapping to the exception for
+            pairs whose requests failed
+        """
+        locations = {}
+        errors = {}
+        for pair, location, error in self.geocode_iter(pairs):
+            if error is None:
+                locations[pair] = location
+            else:
+                errors[pair] = error
+        return locations, errors
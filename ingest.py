@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+"""
+Prepare WaPo-schema CSVs too big to hold in memory and write them to the columnar store
+
+Run with: python ingest.py data.csv [more.csv ...] --output data.feather
+"""
+
+import argparse
+import os
+import pandas as pd
+import utils
+from instrument import timed
+
+CHUNK_SIZE = 100000
+LOCATION_KEYS = ['city', 'state', 'armed']
+
+
+def read_chunks(paths, chunk_size=CHUNK_SIZE):
+    """
+    Read one or more CSVs in the WaPo schema chunk by chunk
+
+    Args:
+        paths: List of CSV paths
+        chunk_size: Rows per chunk
+    Yields:
+        Dataframes of at most chunk_size rows with the types of utils.read_data
+    """
+    for path in paths:
+        for chunk in pd.read_csv(path, dtype=utils.SCHEMA, parse_dates=utils.DATE_COLUMNS, chunksize=chunk_size):
+            yield chunk
+
+
+def _spill_schema(chunk):
+    import pyarrow as pa
+
+    # Categories differ between chunks so categoricals are spilled as plain strings
+    fields = [pa.field(column, pa.string()) if isinstance(chunk[column].dtype, pd.CategoricalDtype)
+              else pa.Schema.from_pandas(chunk[[column]], preserve_index=False).field(column)
+              for column in chunk.columns]
+    return pa.schema(fields)
+
+
+def _spill_frame(chunk):
+    return chunk.astype({column: object for column in chunk.columns
+                         if isinstance(chunk[column].dtype, pd.CategoricalDtype)})
+
+
+@timed
+def ingest(paths, path=utils.DATA_PATH, chunk_size=CHUNK_SIZE, overrides_path=utils.OVERRIDES_PATH, **kwargs):
+    """
+    Prepare CSVs chunk by chunk and write the result to a Feather file readable by utils.load_data
+
+    The first pass fixes city names, looks up coordinates and applies the overrides of every
+    chunk, spills it to a temporary Arrow stream and keeps running totals: shootings per
+    city/state/armed value and the values of every categorical column. The second pass reads
+    the spill back in chunks, adds num_shootings and common_armed from the totals and writes
+    the store with one set of categories per column. Memory is bounded by the chunk size plus
+    the number of distinct city/state/armed combinations, not the number of rows.
+
+    Args:
+        paths: List of CSV paths in the WaPo schema, their rows are appended in order
+        path: Feather file to write
+        chunk_size: Rows per chunk
+        overrides_path: Path to coordinate override table
+        **kwargs: Passed on to utils.get_coordinates (cache_path, backend, offline, etc)
+    Returns:
+        Number of rows written
+    """
+    import pyarrow as pa
+
+    overrides = utils.load_overrides(overrides_path)
+    coordinates = {}
+    totals = None
+    categories = {}
+    spill_path = path + ".spill"
+    writer = None
+    rows = 0
+    try:
+        for chunk in read_chunks(paths, chunk_size):
+            chunk = chunk.reset_index(drop=True)
+            utils.fix_city_names(chunk)
+            # Only geocode pairs no earlier chunk had, one row per pair
+            pairs = chunk[['city', 'state']].dropna().astype(object).drop_duplicates()
+            new = pairs.loc[[pair not in coordinates for pair in zip(pairs['city'], pairs['state'])]]
+            if len(new):
+                located = utils.get_coordinates(new.reset_index(drop=True), **kwargs)
+                coordinates.update({(city, state): (lat, lon) for city, state, lat, lon in
+                                    located[['city', 'state', 'lat', 'lon']].itertuples(index=False)})
+            utils.assign_coordinates(chunk, coordinates)
+            utils.apply_overrides(chunk, overrides, kind='missing')
+            utils.apply_overrides(chunk, overrides, kind='fix')
+
+            # Running shootings per city/state/armed value, summed with the earlier chunks' totals
+            counts = utils.count_armed(chunk[LOCATION_KEYS].astype(object))
+            if totals is not None:
+                counts = pd.concat([totals, counts]).groupby(LOCATION_KEYS, dropna=False, sort=False)['count']
+                counts = counts.sum().reset_index()
+            totals = counts
+            for column in utils.CATEGORICAL_COLUMNS:
+                if column in chunk.columns:
+                    categories.setdefault(column, set()).update(chunk[column].dropna().astype(object).unique())
+            if writer is None:
+                schema = _spill_schema(chunk)
+                # Arrow doesn't keep every pandas type (e.g. the nullable string type) through the spill
+                dtypes = {column: dtype for column, dtype in chunk.dtypes.items()
+                          if not isinstance(dtype, pd.CategoricalDtype)}
+                writer = pa.ipc.new_stream(spill_path, schema)
+            writer.write_batch(pa.RecordBatch.from_pandas(_spill_frame(chunk), schema=schema, preserve_index=False))
+            rows += len(chunk)
+        if writer is None:
+            raise ValueError("No rows in %s" % ", ".join(paths))
+        writer.close()
+        writer = None
+
+        features = utils.location_features(totals)
+        categories['common_armed'] = set(features['common_armed'].dropna())
+        temp_path = path + ".tmp"
+        with pa.memory_map(spill_path) as source:
+            reader = pa.ipc.open_stream(source)
+            store = None
+            for batch in reader:
+                chunk = batch.to_pandas().astype(dtypes)
+                utils.assign_location_features(chunk, features)
+                for column, values in categories.items():
+                    chunk[column] = pd.Categorical(chunk[column], categories=sorted(values))
+                if store is None:
+                    schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+                    store = pa.ipc.new_file(temp_path, schema)
+                store.write_batch(pa.RecordBatch.from_pandas(chunk, schema=schema, preserve_index=False))
+            store.close()
+        os.replace(temp_path, path)
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(spill_path):
+            os.remove(spill_path)
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('csvs', nargs='+', help="CSV files in the WaPo schema")
+    parser.add_argument('--output', default=utils.DATA_PATH, help="Feather file to write")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="Rows per chunk")
+    parser.add_argument('--offline', action='store_true', help="Only geocode from the gazetteer and cache")
+    args = parser.parse_args()
+    print("Wrote %d rows to %s" % (ingest(args.csvs, args.output, args.chunk_size, offline=args.offline),
+                                   args.output))
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak RSS is left out there
+    resource = None
+
+PREFIX = "shootings_"
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes everywhere else
+    return peak / 2 ** 20 if os.uname().sysname == 'Darwin' else peak / 2 ** 10
+
+
+class Metrics(object):
+    """
+    Thread-safe store of stage timings, counters and latency histograms
+
+    Stages are recorded by the timed decorator, counters and histograms by the geocoding
+    engine and cache. Stages called from inside other stages (e.g. get_coordinates during
+    refresh) are recorded separately, so their times overlap.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Forget everything recorded so far
+        """
+        with self.lock:
+            self.stages = {}
+            self.counters = {}
+            self.histograms = {}
+
+    def record_stage(self, name, wall, cpu, rows=None, peak_traced_mb=None):
+        with self.lock:
+            stage = self.stages.setdefault(name, dict(calls=0, wall_seconds=0.0, cpu_seconds=0.0, rows=0,
+                                                      process_peak_rss_mb=None, peak_traced_mb=None))
+            stage['calls'] += 1
+            stage['wall_seconds'] += wall
+            stage['cpu_seconds'] += cpu
+            stage['rows'] += rows or 0
+            # ru_maxrss is the process's high-water mark, not the stage's own peak
+            stage['process_peak_rss_mb'] = _peak_rss_mb()
+            if peak_traced_mb is not None:
+                stage['peak_traced_mb'] = max(stage['peak_traced_mb'] or 0.0, peak_traced_mb)
+
+    def count(self, name, value=1, **labels):
+        """
+        Add to a counter, e.g. count('geocode_failures_total', kind='transient')
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS):
+        """
+        Add a value (e.g. a request latency in seconds) to a histogram
+        """
+        with self.lock:
+            histogram = self.histograms.setdefault(name, dict(buckets=list(buckets), counts=[0] * len(buckets),
+                                                              sum=0.0, count=0))
+            for i, bound in enumerate(histogram['buckets']):
+                if value <= bound:
+                    histogram['counts'][i] += 1
+                    break
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def counter(self, name, **labels):
+        """
+        Current value of a counter, summed over any labels not given
+        """
+        with self.lock:
+            return sum(value for (counter, counter_labels), value in self.counters.items()
+                       if counter == name and set(labels.items()) <= set(counter_labels))
+
+    def snapshot(self):
+        """
+        Everything recorded so far as plain dicts and lists
+
+        Returns:
+            Dictionary with stages, counters, histograms and cache_hit_rates. Hit rates are
+            hits / (hits + misses) of every <name>_hits_total / <name>_misses_total pair
+        """
+        with self.lock:
+            snapshot = dict(stages={name: dict(stage) for name, stage in self.stages.items()},
+                            counters=[dict(name=name, labels=dict(labels), value=value)
+                                      for (name, labels), value in sorted(self.counters.items())],
+                            histograms={name: dict(histogram, counts=list(histogram['counts']))
+                                        for name, histogram in self.histograms.items()})
+        rates = {}
+        for name in set(counter['name'] for counter in snapshot['counters']):
+            if name.endswith('_hits_total'):
+                cache = name[:-len('_hits_total')]
+                hits = self.counter(name)
+                lookups = hits + self.counter(cache + '_misses_total')
+                rates[cache] = hits / float(lookups) if lookups else None
+        snapshot['cache_hit_rates'] = rates
+        return snapshot
+
+    def to_prometheus(self):
+        """
+        Everything recorded so far in the Prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for field, kind in [('calls', 'counter'), ('wall_seconds', 'counter'), ('cpu_seconds', 'counter'),
+                            ('rows', 'counter'), ('process_peak_rss_mb', 'gauge'), ('peak_traced_mb', 'gauge')]:
+            metric = PREFIX + "stage_" + field + ("_total" if kind == 'counter' else "")
+            lines.append("# TYPE %s %s" % (metric, kind))
+            for name, stage in sorted(snapshot['stages'].items()):
+                if stage[field] is not None:
+                    lines.append('%s{stage="%s"} %r' % (metric, name, stage[field]))
+        typed = set()
+        for counter in snapshot['counters']:
+            metric = PREFIX + counter['name']
+            if metric not in typed:
+                lines.append("# TYPE %s counter" % metric)
+                typed.add(metric)
+            labels = ",".join('%s="%s"' % item for item in sorted(counter['labels'].items()))
+            lines.append("%s%s %r" % (metric, "{%s}" % labels if labels else "", counter['value']))
+        for name, histogram in sorted(snapshot['histograms'].items()):
+            metric = PREFIX + name
+            lines.append("# TYPE %s histogram" % metric)
+            cumulative = 0
+            for bound, count in zip(histogram['buckets'], histogram['counts']):
+                cumulative += count
+                lines.append('%s_bucket{le="%r"} %d' % (metric, bound, cumulative))
+            lines.append('%s_bucket{le="+Inf"} %d' % (metric, histogram['count']))
+            lines.append("%s_sum %r" % (metric, histogram['sum']))
+            lines.append("%s_count %d" % (metric, histogram['count']))
+        for cache, rate in sorted(snapshot['cache_hit_rates'].items()):
+            if rate is not None:
+                lines.append("# TYPE %s%s_hit_ratio gauge" % (PREFIX, cache))
+                lines.append("%s%s_hit_ratio %r" % (PREFIX, cache, rate))
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Write the metrics to a file, as a Prometheus textfile if path ends in .prom, JSON otherwise
+
+        The file is swapped in atomically so a collector never reads half of it.
+        """
+        temp_path = path + ".tmp"
+        with open(temp_path, 'w') as f:
+            if path.endswith('.prom'):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.snapshot(), f, indent=2, sort_keys=True)
+        os.replace(temp_path, path)
+
+
+METRICS = Metrics()
+
+
+def _rows(value):
+    return len(value) if hasattr(value, 'columns') else None
+
+
+# Peaks of the enclosing TracedPeak blocks from before their inner blocks reset tracemalloc
+_peaks = []
+
+
+class TracedPeak(object):
+    """
+    Measure the peak tracemalloc memory of a block, nested blocks don't hide each other's peaks
+
+    tracemalloc keeps a single peak, so a block resets it on entry after saving the
+    enclosing block's peak so far and on exit hands its own peak back to the enclosing
+    block. mb is None if tracemalloc isn't tracing. Before Python 3.9 the peak can't be
+    reset, so a nested block reports at least the enclosing block's peak before it started.
+
+    Example:
+        with TracedPeak() as peak:
+            utils.refresh()
+        print(peak.mb)
+    """
+
+    def __init__(self):
+        self.mb = None
+        self.tracing = False
+
+    def __enter__(self):
+        self.tracing = tracemalloc.is_tracing()
+        if self.tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            if _peaks:
+                _peaks[-1] = max(_peaks[-1], peak)
+            _peaks.append(current)
+            # New in Python 3.9, without it the block's peak includes the enclosing block's so far
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+        return self
+
+    def __exit__(self, *exc):
+        if self.tracing:
+            peak = max(_peaks.pop(), tracemalloc.get_traced_memory()[1])
+            if _peaks:
+                _peaks[-1] = max(_peaks[-1], peak)
+            self.mb = peak / 2 ** 20
+
+
+def timed(function):
+    """
+    Decorator recording wall time, CPU time, row counts and memory of every call in METRICS
+
+    Rows is the length of the first argument if it is a dataframe, otherwise of the returned
+    dataframe (for loaders). While profiling is on the peak traced memory of the call,
+    including any timed calls it makes, is recorded too.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        with TracedPeak() as peak:
+            result = function(*args, **kwargs)
+        rows = _rows(args[0]) if args else None
+        METRICS.record_stage(function.__name__, time.perf_counter() - wall, time.process_time() - cpu,
+                             rows if rows is not None else _rows(result), peak.mb)
+        return result
+    return wrapper
+
+
+@contextmanager
+def profiling(stats_path=None):
+    """
+    Deep dive mode: run the block under cProfile and tracemalloc
+
+    Every timed stage also records its peak traced memory while this is active. Both tools
+    slow the code down noticeably, so don't compare wall times measured with it on.
+
+    Example:
+        with instrument.profiling('refresh.pstats'):
+            utils.refresh()
+
+    Args:
+        stats_path: Where to dump the cProfile stats (readable with pstats or snakeviz), None to skip
+    Yields:
+        cProfile.Profile instance
+    """
+    profiler = cProfile.Profile()
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if started_tracing:
+            tracemalloc.stop()
+        if stats_path is not None:
+            profiler.dump_stats(stats_path)
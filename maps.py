@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pandas as pd
+
+MARKER_COLOR = "rgb(255, 102, 102)"
+
+
+def cell_degrees_for_zoom(zoom):
+    """
+    Grid cell size that keeps roughly the same on-screen density at each map zoom level
+
+    Args:
+        zoom: Zoom level, 0 shows the whole USA, every level doubles the scale
+    Returns:
+        Cell size in degrees
+    """
+    return 1.0 / 2 ** zoom
+
+
+def aggregate_points(data, split_by=None, cell_degrees=None):
+    """
+    Collapse individual shootings into one point per location or grid cell
+
+    Without cell_degrees points are grouped by city/state (every row of a city has the same
+    coordinates). With cell_degrees points are binned into a lat/lon grid and placed at the
+    mean position of the shootings in the cell.
+
+    Args:
+        data: Pandas DataFrame containing lat/lon data
+        split_by: Optional column (e.g. 'year' or 'state') to aggregate separately for
+        cell_degrees: Grid cell size in degrees, None to group by city/state
+    Returns:
+        Dataframe with split_by (if given), lat, lon, count and text columns
+    """
+    frame = data.dropna(subset=['lat', 'lon'])
+    frame = pd.DataFrame({'lat': frame['lat'].astype(float), 'lon': frame['lon'].astype(float),
+                          'city': frame['city'].astype(object), 'state': frame['state'].astype(object),
+                          'date': frame['date'] if 'date' in frame.columns else pd.NaT})
+    if split_by == 'year':
+        frame['year'] = pd.to_datetime(frame['date']).dt.year
+    elif split_by is not None:
+        frame[split_by] = data.loc[frame.index, split_by].astype(object)
+    groups = [split_by] if split_by is not None else []
+
+    if cell_degrees is None:
+        keys = groups + [column for column in ['state', 'city'] if column not in groups]
+        points = frame.groupby(keys, sort=False).agg(
+            lat=('lat', 'first'), lon=('lon', 'first'), count=('lat', 'size')).reset_index()
+        points['text'] = points['city'] + ", " + points['state'] + ": " + points['count'].astype(str)
+    else:
+        frame['row'] = np.floor(frame['lat'] / cell_degrees).astype(int)
+        frame['col'] = np.floor(frame['lon'] / cell_degrees).astype(int)
+        points = frame.groupby(groups + ['row', 'col'], sort=False).agg(
+            lat=('lat', 'mean'), lon=('lon', 'mean'), count=('lat', 'size'), city=('city', 'first'),
+            cities=('city', 'nunique')).reset_index()
+        points['text'] = np.where(points['cities'] > 1,
+                                  points['city'] + " and " + (points['cities'] - 1).astype(str) + " more",
+                                  points['city']) + ": " + points['count'].astype(str)
+    return points[groups + ['lat', 'lon', 'count', 'text']]
+
+
+def build_traces(points, split_by=None, max_marker_size=30, decimals=4):
+    """
+    Build one compact scattergeo trace per group of aggregated points
+
+    Marker area is proportional to the number of shootings at each point.
+
+    Args:
+        points: Dataframe from aggregate_points
+        split_by: Column points were split by, None for a single trace
+        max_marker_size: Diameter in pixels of the marker with the most shootings
+        decimals: Coordinates are rounded to this many decimals to shrink the payload
+    Returns:
+        List of scattergeo trace dicts
+    """
+    scale = max_marker_size / np.sqrt(max(points['count'].max(), 1)) if len(points) else 1
+    groups = points.groupby(split_by, sort=True) if split_by is not None else [("All", points)]
+    traces = []
+    for name, group in groups:
+        traces.append(dict(
+            type='scattergeo',
+            locationmode='USA-states',
+            lat=group['lat'].round(decimals).tolist(),
+            lon=group['lon'].round(decimals).tolist(),
+            text=group['text'].tolist(),
+            mode='markers',
+            marker=dict(size=np.maximum(np.sqrt(group['count']) * scale, 4).round(1).tolist(),
+                        color=MARKER_COLOR, opacity=0.5, line=dict(width=0.5, color=MARKER_COLOR)),
+            name=str(name)
+        ))
+    return traces
+
+
+def build_map_figure(data, split_by='year', cell_degrees=None, title='US police shootings (2015-Present)'):
+    """
+    Map figure with one aggregated trace per group and a slider to switch between them
+
+    Only the first trace starts visible, and every slider step shows exactly one trace,
+    so the map is never empty.
+
+    Args:
+        data: Pandas DataFrame containing lat/lon data
+        split_by: Column to split by ('year', 'state', etc), None for a single trace
+        cell_degrees: Grid cell size in degrees (see cell_degrees_for_zoom), None to group by city
+        title: Figure title
+    Returns:
+        Figure dict that can be passed to plotly's iplot
+    """
+    traces = build_traces(aggregate_points(data, split_by, cell_degrees), split_by)
+    for i, trace in enumerate(traces):
+        trace['visible'] = i == 0
+    layout = dict(
+        title=title,
+        showlegend=False,
+        geo=dict(
+            scope='usa',
+            projection=dict(type='albers usa'),
+            showland=True,
+            landcolor='rgb(217, 217, 217)',
+            subunitwidth=1,
+            countrywidth=1,
+            subunitcolor="rgb(255, 255, 255)",
+            countrycolor="rgb(255, 255, 255)"
+        ),
+    )
+    if len(traces) > 1:
+        steps = [dict(method='restyle', label=trace['name'],
+                      args=['visible', [j == i for j in range(len(traces))]]) for i, trace in enumerate(traces)]
+        layout['sliders'] = [dict(active=0, currentvalue=dict(prefix=(split_by or '') + ': '), steps=steps)]
+    return dict(data=traces, layout=layout)
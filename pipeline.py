@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+
+"""
+Run the data preparation steps of DataPreparation.ipynb as a cached pipeline
+
+Run with: python pipeline.py [stage]
+Every stage saves its output in .pipeline/ keyed by the hash of its code, its settings,
+the files it reads and the contents of its input artifacts, so a stage only runs again
+when one of those changed. Give a stage name to run only it and the stages it needs.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from collections import namedtuple
+import numpy as np
+import utils
+from gazetteer import GazetteerBackend, GAZETTEER_PATH
+from geocache import GeocodeCache, GEOCODE_CACHE_PATH
+from instrument import METRICS, profiling
+from store import code_source
+
+CACHE_DIR = ".pipeline"
+MANIFEST_FILE = "manifest.json"
+
+DEFAULT_OPTIONS = {'csv_path': utils.CSV_PATH, 'data_path': utils.DATA_PATH, 'overrides_path': utils.OVERRIDES_PATH,
+                   'cache_path': GEOCODE_CACHE_PATH, 'gazetteer_path': GAZETTEER_PATH, 'offline': False}
+
+# inputs: upstream stage names, files: options naming files whose contents the stage reads,
+# settings: other options the output depends on, code: functions and constants the output depends on,
+# output: option naming a file the stage writes outside the cache, run: function(frames, options),
+# unresolved: optional function(output, options) counting rows of the output that a later run could
+# still fill in, the stage is treated as out of date while the count isn't zero
+Stage = namedtuple('Stage', ['inputs', 'files', 'settings', 'code', 'output', 'run', 'unresolved'],
+                   defaults=[None])
+
+
+def _read(frames, options):
+    return utils.read_data(options['csv_path'])
+
+
+def _fix_city_names(frames, options):
+    data = frames[0]
+    utils.fix_city_names(data)
+    return data
+
+
+def _geocode(frames, options):
+    return utils.get_coordinates(frames[0], cache_path=options['cache_path'], offline=options['offline'],
+                                 gazetteer_path=options['gazetteer_path'])
+
+
+def _unresolved_pairs(data, options):
+    # Pairs with neither an exact gazetteer match nor a cache entry failed with a transient
+    # error, were skipped offline or only got a fuzzy match, a later run may geocode them
+    pairs = list(data.groupby(['city', 'state'], observed=True).groups.keys())
+    with GeocodeCache(options['cache_path']) as cache:
+        cached = cache.get_many(pairs)
+    pending = [pair for pair in pairs if pair not in cached]
+    gazetteer_path = options['gazetteer_path']
+    if pending and gazetteer_path is not None and os.path.exists(gazetteer_path):
+        cities, states = zip(*pending)
+        lats, _ = GazetteerBackend(gazetteer_path).lookup_many(cities, states, fuzzy=False)
+        pending = [pair for pair, lat in zip(pending, lats) if np.isnan(lat)]
+    return len(pending)
+
+
+def _add_coordinates(frames, options):
+    data = frames[0]
+    utils.apply_overrides(data, kind='missing', path=options['overrides_path'])
+    return data
+
+
+def _fix_coordinates(frames, options):
+    data = frames[0]
+    utils.apply_overrides(data, kind='fix', path=options['overrides_path'])
+    return data
+
+
+def _location_features(frames, options):
+    data = frames[0]
+    utils.add_location_features(data)
+    return data
+
+
+def _serialize(frames, options):
+    utils.serialize_data(frames[0], options['data_path'])
+    return frames[0]
+
+
+# In notebook order. The notebook also saved the data after add_coordinates, that checkpoint
+# is now the add_coordinates artifact
+STAGES = {
+    'read': Stage([], ['csv_path'], [], [utils.read_data, utils.SCHEMA], None, _read),
+    'fix_city_names': Stage(['read'], [], [], [utils.fix_city_names, utils.CITY_NAME_FIXES], None, _fix_city_names),
+    # The geocode cache isn't an input, it only makes geocoding faster. Pairs that failed, were
+    # skipped offline or only matched fuzzily aren't settled yet, so the stage runs again until they are
+    'geocode': Stage(['fix_city_names'], ['gazetteer_path'], ['offline'],
+                     [utils.get_coordinates, utils.assign_coordinates], None, _geocode, _unresolved_pairs),
+    'add_coordinates': Stage(['geocode'], ['overrides_path'], [], [utils.apply_overrides, utils.load_overrides],
+                             None, _add_coordinates),
+    'fix_coordinates': Stage(['add_coordinates'], ['overrides_path'], [],
+                             [utils.apply_overrides, utils.load_overrides], None, _fix_coordinates),
+    'location_features': Stage(['fix_coordinates'], [], [],
+                               [utils.add_location_features, utils.count_armed, utils.location_features,
+                                utils.assign_location_features], None, _location_features),
+    'serialize': Stage(['location_features'], [], [], [utils.serialize_data, utils.CATEGORICAL_COLUMNS],
+                       'data_path', _serialize),
+}
+
+
+def stage_key(name, options, manifest):
+    """
+    Hash of everything a stage's output depends on
+
+    Args:
+        name: Stage name in STAGES
+        options: Pipeline options, see DEFAULT_OPTIONS
+        manifest: Manifest with the content hashes of the stage's up to date inputs
+    Returns:
+        Hex digest
+    """
+    stage = STAGES[name]
+    sha1 = hashlib.sha1()
+    for item in [stage.run] + stage.code:
+        sha1.update(code_source(item).encode('utf-8'))
+    for option in stage.files:
+        path = options[option]
+        sha1.update((utils.file_hash(path) if path is not None and os.path.exists(path) else 'missing').encode('utf-8'))
+    for option in stage.settings:
+        sha1.update(repr(options[option]).encode('utf-8'))
+    for upstream in stage.inputs:
+        sha1.update(manifest[upstream]['content_hash'].encode('utf-8'))
+    return sha1.hexdigest()
+
+
+def plan(target=None):
+    """
+    Stages needed to build a target, in the order they have to run
+
+    Args:
+        target: Stage name, None for every stage
+    Returns:
+        List of stage names
+    """
+    if target is None:
+        return list(STAGES)
+    if target not in STAGES:
+        raise ValueError("Unknown stage: %s" % target)
+    needed = set()
+    pending = [target]
+    while pending:
+        name = pending.pop()
+        if name not in needed:
+            needed.add(name)
+            pending.extend(STAGES[name].inputs)
+    return [name for name in STAGES if name in needed]
+
+
+def _is_current(name, key, options, manifest, cache_dir):
+    entry = manifest.get(name)
+    if entry is None or entry['key'] != key or entry.get('unresolved'):
+        return False
+    artifact = os.path.join(cache_dir, name + ".feather")
+    if not os.path.exists(artifact) or utils.file_hash(artifact) != entry['content_hash']:
+        return False
+    output = STAGES[name].output
+    return output is None or (os.path.exists(options[output]) and
+                              utils.file_hash(options[output]) == entry['content_hash'])
+
+
+def run_pipeline(target=None, force=False, cache_dir=CACHE_DIR, **options):
+    """
+    Run the stages needed for a target, skipping stages whose artifact is up to date
+
+    Args:
+        target: Stage name, None to run the whole pipeline
+        force: If True re-run every needed stage
+        cache_dir: Directory with the stage artifacts and manifest
+        **options: Overrides of DEFAULT_OPTIONS (csv_path, data_path, offline, etc)
+    Returns:
+        List of (stage name, status, seconds, rows) tuples where status is "ran" or "cached"
+    """
+    unknown = set(options) - set(DEFAULT_OPTIONS)
+    if unknown:
+        raise ValueError("Unknown pipeline option(s): %s" % ", ".join(sorted(unknown)))
+    options = dict(DEFAULT_OPTIONS, **options)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    manifest_path = os.path.join(cache_dir, MANIFEST_FILE)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    report = []
+    # Outputs of stages that ran in this call, so downstream stages don't reload them
+    frames = {}
+    for name in plan(target):
+        stage = STAGES[name]
+        key = stage_key(name, options, manifest)
+        if not force and _is_current(name, key, options, manifest, cache_dir):
+            report.append((name, 'cached', 0.0, manifest[name]['rows']))
+            continue
+        inputs = [frames[upstream] if upstream in frames else
+                  utils.load_data(os.path.join(cache_dir, upstream + ".feather")) for upstream in stage.inputs]
+        start = time.time()
+        cpu = time.process_time()
+        data = stage.run(inputs, options)
+        seconds = time.time() - start
+        METRICS.record_stage('pipeline.' + name, seconds, time.process_time() - cpu, len(data))
+        artifact = os.path.join(cache_dir, name + ".feather")
+        utils.serialize_data(data, artifact)
+        frames[name] = data
+        manifest[name] = dict(key=key, content_hash=utils.file_hash(artifact), seconds=seconds, rows=len(data))
+        if stage.unresolved is not None:
+            manifest[name]['unresolved'] = stage.unresolved(data, options)
+            if manifest[name]['unresolved']:
+                print("%s: %d unresolved, the stage will run again next time" % (name, manifest[name]['unresolved']))
+        # Save after every stage so an interrupted run keeps the stages it finished
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        report.append((name, 'ran', seconds, len(data)))
+    return report
+
+
+def format_report(report):
+    """
+    Format the result of run_pipeline as a table of per-stage wall times
+    """
+    lines = ["%-20s %-7s %10s %8s" % ('stage', 'status', 'seconds', 'rows')]
+    for name, status, seconds, rows in report:
+        lines.append("%-20s %-7s %10.3f %8d" % (name, status, seconds, rows))
+    lines.append("%-20s %-7s %10.3f" % ('total', '', sum(seconds for _, _, seconds, _ in report)))
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('stage', nargs='?', help="Stage to run with the stages it needs, all if empty: %s" %
+                        ", ".join(STAGES))
+    parser.add_argument('--csv', default=utils.CSV_PATH, help="WaPo CSV to prepare")
+    parser.add_argument('--data', default=utils.DATA_PATH, help="Where the serialize stage writes the dataset")
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help="Directory for stage artifacts")
+    parser.add_argument('--offline', action='store_true', help="Only geocode from the gazetteer and cache")
+    parser.add_argument('--force', action='store_true', help="Run stages even if they are up to date")
+    parser.add_argument('--list', action='store_true', help="List the stages and exit")
+    parser.add_argument('--metrics', help="Write stage timings, geocoder and cache metrics to this file "
+                        "(Prometheus textfile if it ends in .prom, JSON otherwise)")
+    parser.add_argument('--profile', help="Run under cProfile and tracemalloc and dump the profile to this file")
+    args = parser.parse_args()
+    if args.list:
+        for name, stage in STAGES.items():
+            print("%-20s <- %s" % (name, ", ".join(stage.inputs) or "-"))
+        parser.exit()
+    if args.stage is not None and args.stage not in STAGES:
+        parser.error("unknown stage: %s" % args.stage)
+    if args.profile:
+        with profiling(args.profile):
+            report = run_pipeline(args.stage, force=args.force, cache_dir=args.cache_dir, csv_path=args.csv,
+                                  data_path=args.data, offline=args.offline)
+    else:
+        report = run_pipeline(args.stage, force=args.force, cache_dir=args.cache_dir, csv_path=args.csv,
+                              data_path=args.data, offline=args.offline)
+    print(format_report(report))
+    if args.metrics:
+        METRICS.write(args.metrics)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pandas as pd
+import store
+import utils
+from gazetteer import normalize_place
+
+POPULATION_PATH = "population.csv"
+# Race value of population rows that count everyone
+TOTAL = 'total'
+LEVELS = ['state', 'place']
+
+
+def load_population(path=POPULATION_PATH):
+    """
+    Load a population table
+
+    The CSV needs state and population columns. state is an abbreviation or a full name from
+    utils.STATE_MAPPINGS. An optional city column holds Census place names ("Wichita city"),
+    rows without a city are state totals. An optional race column uses the WaPo race codes
+    (W, B, H, A, N, O), rows without a race are totals for everyone.
+
+    Args:
+        path: Path to population CSV
+    Returns:
+        Dataframe with level ('state' or 'place'), state, city, race and population columns
+    """
+    population = pd.read_csv(path, dtype={'state': str, 'city': str, 'race': str})
+    for column in ['city', 'race']:
+        if column not in population.columns:
+            population[column] = pd.Series(np.nan, index=population.index, dtype=str)
+    abbreviations = {name.lower(): abbr for abbr, name in utils.STATE_MAPPINGS.items()}
+    abbreviations.update({abbr.lower(): abbr for abbr in utils.STATE_MAPPINGS})
+    states = population['state'].str.strip().str.lower().map(abbreviations)
+    if states.isna().any():
+        raise ValueError("Unknown states in population table: %s" %
+                         ", ".join(sorted(population.loc[states.isna(), 'state'].astype(str).unique())))
+    population['state'] = states
+    population['race'] = population['race'].str.strip().str.upper().fillna(TOTAL).replace('', TOTAL)
+    population.loc[population['race'] == TOTAL.upper(), 'race'] = TOTAL
+    population['level'] = np.where(population['city'].isna(), 'state', 'place')
+    duplicated = population.duplicated(['state', 'city', 'race'], keep=False)
+    if duplicated.any():
+        rows = population.loc[duplicated, ['city', 'state', 'race']].drop_duplicates().fillna('')
+        raise ValueError("Duplicate population rows for: %s" %
+                         ", ".join("%s, %s (%s)" % tuple(row) for row in rows.values))
+    return population[['level', 'state', 'city', 'race', 'population']].astype({'population': float})
+
+
+def join_population(data, population):
+    """
+    Match the places of a population table to the city names used in the data
+
+    Census place names ("St. Louis city") and WaPo city names ("St. Louis") are compared
+    after normalize_place. Places that match no city keep their Census name, they still
+    count towards totals but never have shootings.
+
+    Args:
+        data: Pandas dataframe of WaPo dataset
+        population: Dataframe from load_population
+    Returns:
+        Copy of population with the city column spelled like the data
+    """
+    population = population.copy()
+    cities = data[['city', 'state']].dropna().astype(object).drop_duplicates()
+    keys = cities['state'] + "|" + cities['city'].map(normalize_place)
+    spelling = pd.Series(cities['city'].to_numpy(), index=keys.to_numpy())
+    spelling = spelling[~spelling.index.duplicated()]
+    places = population['level'] == 'place'
+    place_keys = population.loc[places, 'state'] + "|" + \
+        population.loc[places, 'city'].map(lambda name: normalize_place(name, strip_suffix=True))
+    matched = spelling.reindex(place_keys.to_numpy()).to_numpy()
+    population.loc[places, 'city'] = np.where(pd.isna(matched), population.loc[places, 'city'], matched)
+    return population
+
+
+def population_path_for(data_path):
+    """
+    Path of the cached population join that belongs to a data file
+    """
+    return store.cache_path_for(data_path, "-population.feather")
+
+
+def load_population_join(data_path=utils.DATA_PATH, population_path=POPULATION_PATH, rebuild=False):
+    """
+    Load the population table joined to a data file, redoing the join if either file changed
+
+    Args:
+        data_path: Path to Feather file written by utils.serialize_data
+        population_path: Path to population CSV, see load_population
+        rebuild: If True ignore the cached join
+    Returns:
+        Dataframe from join_population
+    """
+    def join():
+        return join_population(utils.load_data(data_path, columns=['city', 'state']),
+                               load_population(population_path))
+
+    return store.load_cached(data_path, "-population.feather", join, sources=[population_path],
+                             rebuild=rebuild)
+
+
+def poisson_interval(counts, confidence=0.95):
+    """
+    Exact (Garwood) confidence interval of Poisson counts
+
+    Args:
+        counts: Array of observed counts
+        confidence: Coverage of the interval
+    Returns:
+        Tuple of (lower, upper) arrays
+    """
+    from scipy.stats import chi2
+
+    counts = np.asarray(counts, dtype=float)
+    alpha = 1 - confidence
+    lower = np.where(counts > 0, chi2.ppf(alpha / 2, 2 * counts) / 2, 0.0)
+    upper = chi2.ppf(1 - alpha / 2, 2 * counts + 2) / 2
+    return lower, upper
+
+
+def rates(data, population, by=('state',), level='state', per=100000, confidence=0.95):
+    """
+    Shootings per capita for any grouping of the data
+
+    The denominator of a group is the population of the state (or place) and race values in
+    by, summed over the ones that aren't. Race specific populations are used when race is in
+    by, totals otherwise. Only shootings in states (or places) that have a population row are
+    counted, so numerators and denominators cover the same area. Rates are over the whole
+    period of the data, add 'year' to by for yearly rates.
+
+    Example: rates(data, population, ['state', 'race'])
+
+    Args:
+        data: Pandas dataframe of WaPo dataset, with a year column if grouping by year
+        population: Dataframe from join_population or load_population_join
+        by: Columns of data to group by
+        level: 'state' to use state populations, 'place' for places (groups by city need this)
+        per: Rates are per this many people
+        confidence: Coverage of the rate intervals
+    Returns:
+        Dataframe with the by columns and count, population, rate, rate_lower and rate_upper
+        columns. When by only has population keys (state, city, race) every key with a
+        population is included, with a count of 0 if it had no shootings
+    """
+    if level not in LEVELS:
+        raise ValueError("Unknown population level: %s" % level)
+    by = list(by)
+    keys = ['city', 'state'] if level == 'place' else ['state']
+    if 'race' in by:
+        keys.append('race')
+    table = population.loc[(population['level'] == level) &
+                           ((population['race'] != TOTAL) if 'race' in by else (population['race'] == TOTAL))]
+    # Rows whose state/place/race has a population
+    inside = pd.MultiIndex.from_frame(table[keys]).get_indexer(
+        pd.MultiIndex.from_arrays([data[key].astype(object) for key in keys])) >= 0
+    frame = pd.DataFrame({column: data.loc[inside, column].astype(object) for column in by})
+    counts = frame.groupby(by, sort=True).size().rename('count') if by else \
+        pd.Series([int(inside.sum())], name='count')
+
+    population_by = [key for key in keys if key in by]
+    if population_by:
+        denominators = table.groupby(population_by, sort=True)['population'].sum()
+    else:
+        denominators = pd.Series([table['population'].sum()], name='population')
+    if not by:
+        result = pd.DataFrame({'count': counts.to_numpy(), 'population': denominators.to_numpy()})
+    elif set(by) <= set(keys):
+        # Every population key is a group, including ones without shootings
+        result = denominators.to_frame().join(counts).reset_index()
+        result['count'] = result['count'].fillna(0).astype(int)
+    else:
+        result = counts.reset_index()
+        if population_by:
+            result = result.join(denominators, on=population_by)
+        else:
+            result['population'] = denominators.iloc[0]
+    result = result[by + ['count', 'population']].reset_index(drop=True)
+
+    scale = per / result['population'].to_numpy(dtype=float)
+    lower, upper = poisson_interval(result['count'], confidence)
+    result['rate'] = result['count'] * scale
+    result['rate_lower'] = lower * scale
+    result['rate_upper'] = upper * scale
+    return result
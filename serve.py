@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+
+"""
+Read-only JSON query service over the prepared dataset
+
+Run with: python serve.py [--port 8000]
+The dataset is loaded once and shared by every client. Endpoints (all GET):
+    /version                      dataset version (SHA-1 of the data file) and row count
+    /shootings?state=CA&year=2016 matching rows, paged with limit/offset, columns=... to pick columns
+    /count?by=state,race&flee=Car number of matching rows per group
+Filters: state, year, race, gender, armed, flee, manner_of_death (comma separated values)
+and lat, lon, radius_km for rows within radius_km of a point.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlsplit
+import numpy as np
+import store
+
+FILTERS = ['state', 'year', 'race', 'gender', 'armed', 'flee', 'manner_of_death']
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 10000
+CACHE_SIZE = 1024
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               500: 'Internal Server Error'}
+
+
+class Dataset(object):
+    """
+    Prepared dataset loaded from a memory-mapped Feather file, reloaded when the file changes
+
+    Args:
+        path: Path to Feather file written by utils.serialize_data
+    """
+
+    def __init__(self, path=store.DATA_PATH):
+        self.path = path
+        self.stat = None
+        self.version = None
+        self.refresh()
+
+    def refresh(self):
+        """
+        Reload the data if the file was rewritten since it was loaded
+
+        Returns:
+            True if the data was reloaded
+        """
+        stat = os.stat(self.path)
+        stat = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if stat == self.stat:
+            return False
+        self.stat = stat
+        version = store.file_hash(self.path)
+        if version == self.version:
+            return False
+        self.version = version
+        self.data = store.load_data(self.path)
+        self.data['year'] = self.data['date'].dt.year
+        self.index = None
+        return True
+
+    def spatial_index(self):
+        # Built on the first radius query, labels are row positions
+        if self.index is None:
+            from spatial import SpatialIndex
+            self.index = SpatialIndex(self.data['lat'].to_numpy(dtype=float), self.data['lon'].to_numpy(dtype=float))
+        return self.index
+
+
+def _values(params, name):
+    return [value for values in params.get(name, []) for value in values.split(',') if value]
+
+
+def _float(params, name, default=None):
+    values = params.get(name)
+    if not values:
+        return default
+    try:
+        value = float(values[-1])
+    except ValueError:
+        raise ValueError("%s must be a number" % name)
+    if not np.isfinite(value):
+        raise ValueError("%s must be a finite number" % name)
+    return value
+
+
+def _count(params, name, default):
+    # Non-negative integer parameter such as limit or offset
+    values = params.get(name)
+    if not values:
+        return default
+    if not (values[-1].isascii() and values[-1].isdigit()):
+        raise ValueError("%s must be a non-negative integer" % name)
+    return int(values[-1])
+
+
+def _error(message):
+    return json.dumps({'error': message}).encode('utf-8')
+
+
+class QueryService(object):
+    """
+    Answers queries against a Dataset, caching the most recent responses
+
+    Cached responses are keyed by the dataset version, so they are dropped as soon as the
+    data file changes.
+
+    Args:
+        dataset: Dataset instance
+        cache_size: Number of responses to keep
+    """
+
+    def __init__(self, dataset, cache_size=CACHE_SIZE):
+        self.dataset = dataset
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.routes = {'/version': self.version, '/shootings': self.shootings, '/count': self.count}
+
+    def mask(self, params):
+        """
+        Boolean array of the rows matching the query's filters
+        """
+        data = self.dataset.data
+        mask = np.ones(len(data), dtype=bool)
+        for name in FILTERS:
+            values = _values(params, name)
+            if values:
+                if name == 'year':
+                    try:
+                        values = [int(value) for value in values]
+                    except ValueError:
+                        raise ValueError("year must be an integer")
+                mask &= data[name].isin(values).to_numpy()
+        lat, lon, radius = _float(params, 'lat'), _float(params, 'lon'), _float(params, 'radius_km')
+        if radius is not None or lat is not None or lon is not None:
+            if radius is None or lat is None or lon is None:
+                raise ValueError("Radius queries need lat, lon and radius_km")
+            inside = np.zeros(len(data), dtype=bool)
+            inside[self.dataset.spatial_index().radius(lat, lon, radius)[0]] = True
+            mask &= inside
+        return mask
+
+    def version(self, params):
+        return {'version': self.dataset.version, 'rows': len(self.dataset.data)}
+
+    def shootings(self, params):
+        data = self.dataset.data
+        columns = _values(params, 'columns') or [column for column in data.columns if column != 'year']
+        unknown = set(columns) - set(data.columns)
+        if unknown:
+            raise ValueError("Unknown columns: %s" % ", ".join(sorted(unknown)))
+        limit = min(_count(params, 'limit', DEFAULT_LIMIT), MAX_LIMIT)
+        offset = _count(params, 'offset', 0)
+        positions = np.flatnonzero(self.mask(params))
+        page = data[columns].iloc[positions[offset:offset + limit]]
+        return {'total': len(positions), 'offset': offset,
+                'rows': json.loads(page.to_json(orient='records', date_format='iso'))}
+
+    def count(self, params):
+        data = self.dataset.data
+        by = _values(params, 'by')
+        unknown = set(by) - set(data.columns)
+        if unknown:
+            raise ValueError("Unknown columns: %s" % ", ".join(sorted(unknown)))
+        rows = data.loc[self.mask(params), by]
+        if not by:
+            return {'groups': [{'count': len(rows)}]}
+        counts = rows.groupby(by, observed=True, dropna=False).size().rename('count').reset_index()
+        counts = counts.sort_values('count', ascending=False, kind='mergesort')
+        return {'groups': json.loads(counts.to_json(orient='records', date_format='iso'))}
+
+    def handle(self, target):
+        """
+        Answer a request
+
+        Args:
+            target: Request path with query string, e.g. /count?by=state
+        Returns:
+            (status code, JSON body bytes) tuple
+        """
+        if self.dataset.refresh():
+            self.cache.clear()
+        url = urlsplit(target)
+        params = parse_qs(url.query)
+        key = (self.dataset.version, url.path, tuple(sorted((name, tuple(values)) for name, values in params.items())))
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        route = self.routes.get(url.path)
+        if route is None:
+            return 404, _error("Unknown path: %s" % url.path)
+        try:
+            response = 200, json.dumps(route(params)).encode('utf-8')
+        except ValueError as e:
+            return 400, _error(str(e))
+        self.cache[key] = response
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return response
+
+
+async def _respond(writer, status, body, keep_alive):
+    writer.write(("HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n"
+                  "Connection: %s\r\n\r\n" % (status, STATUS_TEXT[status], len(body),
+                                              'keep-alive' if keep_alive else 'close')).encode('latin-1'))
+    writer.write(body)
+    await writer.drain()
+
+
+async def handle_connection(service, reader, writer):
+    """
+    Serve HTTP/1.1 requests on one connection until the client closes it
+
+    Malformed requests get a 400 and the connection is closed, since the rest of the
+    stream can't be parsed reliably. Errors while answering a request give a 500.
+    """
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            parts = request_line.decode('latin-1').split()
+            if len(parts) != 3:
+                await _respond(writer, 400, _error("Malformed request line"), False)
+                break
+            method, target, protocol = parts
+            length = headers.get('content-length', '0')
+            if not (length.isascii() and length.isdigit()):
+                await _respond(writer, 400, _error("Content-Length must be a non-negative integer"), False)
+                break
+            if int(length):
+                await reader.readexactly(int(length))
+            if method != 'GET':
+                status, body = 405, _error("Only GET is supported")
+            else:
+                try:
+                    status, body = service.handle(target)
+                except Exception as e:
+                    print("Error handling", target, repr(e))
+                    status, body = 500, _error("Internal server error")
+            keep_alive = headers.get('connection', '').lower() != 'close' and protocol == 'HTTP/1.1'
+            await _respond(writer, status, body, keep_alive)
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host='127.0.0.1', port=8000, path=store.DATA_PATH, cache_size=CACHE_SIZE):
+    """
+    Run the query service until cancelled
+
+    Args:
+        host: Interface to listen on, local only by default
+        port: Port to listen on
+        path: Path to Feather file written by utils.serialize_data
+        cache_size: Number of responses to cache
+    """
+    service = QueryService(Dataset(path), cache_size)
+    server = await asyncio.start_server(lambda reader, writer: handle_connection(service, reader, writer), host, port)
+    print("Serving %s (version %s) on http://%s:%d" % (path, service.dataset.version[:12], host, port))
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1', help="Interface to listen on")
+    parser.add_argument('--port', type=int, default=8000, help="Port to listen on")
+    parser.add_argument('--data', default=store.DATA_PATH, help="Prepared dataset written by utils.serialize_data")
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE, help="Number of responses to cache")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.data, args.cache_size))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+import numpy as np
+import store
+from validate import EARTH_RADIUS_KM
+
+
+def to_unit_vectors(lat, lon):
+    """
+    Convert lat/lon in degrees to points on the unit sphere
+
+    Straight-line (chord) distance between unit vectors grows monotonically with
+    great-circle distance, so a Euclidean KD-tree over them answers haversine queries.
+
+    Args:
+        lat: Array of latitudes
+        lon: Array of longitudes
+    Returns:
+        Array of shape (n, 3)
+    """
+    lat = np.radians(np.asarray(lat, dtype=float))
+    lon = np.radians(np.asarray(lon, dtype=float))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def km_to_chord(km):
+    return 2 * np.sin(np.asarray(km, dtype=float) / (2 * EARTH_RADIUS_KM))
+
+
+def chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord, dtype=float) / 2, 0, 1))
+
+
+class SpatialIndex(object):
+    """
+    KD-tree over shooting locations for radius, nearest neighbor and bounding box queries
+
+    Queries take arrays of points so many lookups run in one vectorized call. Results are
+    labels from the index of the frame the tree was built from.
+
+    Args:
+        lat: Array of latitudes
+        lon: Array of longitudes
+        labels: Array of row labels, defaults to positions
+    """
+
+    def __init__(self, lat, lon, labels=None):
+        from scipy.spatial import cKDTree
+
+        lat = np.asarray(lat, dtype=float)
+        lon = np.asarray(lon, dtype=float)
+        known = ~(np.isnan(lat) | np.isnan(lon))
+        self.labels = (np.arange(len(lat)) if labels is None else np.asarray(labels))[known]
+        self.lat = lat[known]
+        self.lon = lon[known]
+        self.tree = cKDTree(to_unit_vectors(self.lat, self.lon))
+        # Latitude sort order used by bounding box queries
+        self.lat_order = np.argsort(self.lat, kind='mergesort')
+
+    def __len__(self):
+        return len(self.labels)
+
+    @classmethod
+    def from_frame(cls, data):
+        """
+        Build the index from a dataframe with lat/lon columns, rows missing either are skipped
+        """
+        return cls(data['lat'].to_numpy(dtype=float), data['lon'].to_numpy(dtype=float), data.index.to_numpy())
+
+    def radius(self, lat, lon, radius_km):
+        """
+        Find every point within a distance of each query point
+
+        Args:
+            lat: Latitude or array of latitudes of the query points
+            lon: Longitude or array of longitudes of the query points
+            radius_km: Distance in kilometers, a scalar or one per query point
+        Returns:
+            List with an array of labels for every query point
+        """
+        radius_km = np.asarray(radius_km, dtype=float)
+        if not (np.isfinite(radius_km).all() and (radius_km >= 0).all()):
+            raise ValueError("radius_km must be a finite, non-negative distance")
+        points = to_unit_vectors(np.atleast_1d(lat), np.atleast_1d(lon))
+        radius = np.broadcast_to(km_to_chord(radius_km), len(points))
+        matches = self.tree.query_ball_point(points, radius)
+        return [self.labels[np.sort(np.asarray(match, dtype=int))] for match in matches]
+
+    def nearest(self, lat, lon, k=1):
+        """
+        Find the k nearest points to each query point
+
+        Args:
+            lat: Latitude or array of latitudes of the query points
+            lon: Longitude or array of longitudes of the query points
+            k: Number of neighbors
+        Returns:
+            Tuple of (distances in km, labels), both of shape (n, k). When the index has fewer
+            than k points the missing neighbors have infinite distance and label None
+        """
+        points = to_unit_vectors(np.atleast_1d(lat), np.atleast_1d(lon))
+        chord, positions = self.tree.query(points, k=k)
+        chord = chord.reshape(len(points), k)
+        positions = positions.reshape(len(points), k)
+        missing = positions >= len(self.labels)
+        labels = np.append(self.labels.astype(object), None)[np.where(missing, len(self.labels), positions)]
+        return np.where(missing, np.inf, chord_to_km(np.where(missing, 0, chord))), labels
+
+    def bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """
+        Find every point inside a lat/lon box
+
+        Args:
+            min_lat, min_lon, max_lat, max_lon: Box corners, scalars or arrays for several boxes
+        Returns:
+            List with an array of labels for every box
+        """
+        boxes = np.broadcast_arrays(*[np.atleast_1d(np.asarray(x, dtype=float))
+                                      for x in (min_lat, min_lon, max_lat, max_lon)])
+        sorted_lat = self.lat[self.lat_order]
+        starts = np.searchsorted(sorted_lat, boxes[0], side='left')
+        ends = np.searchsorted(sorted_lat, boxes[2], side='right')
+        results = []
+        for start, end, low, high in zip(starts, ends, boxes[1], boxes[3]):
+            candidates = self.lat_order[start:end]
+            lon = self.lon[candidates]
+            results.append(self.labels[np.sort(candidates[(lon >= low) & (lon <= high)])])
+        return results
+
+
+def index_path_for(data_path):
+    """
+    Path of the cached spatial index that belongs to a data file
+    """
+    return store.cache_path_for(data_path, "-spatial.pkl")
+
+
+def load_index(data_path=store.DATA_PATH, rebuild=False):
+    """
+    Load the spatial index for a data file, building and caching it if the data changed
+
+    Args:
+        data_path: Path to Feather file written by utils.serialize_data
+        rebuild: If True ignore the cached index
+    Returns:
+        SpatialIndex whose labels are row positions of store.load_data(data_path)
+    """
+    return store.load_cached(data_path, "-spatial.pkl",
+                             lambda: SpatialIndex.from_frame(store.load_data(data_path, columns=['lat', 'lon'])),
+                             rebuild=rebuild)
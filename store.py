@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+"""
+Read path for the prepared dataset
+
+Importing this module only pulls in the standard library, pyarrow is imported on the first
+load and pandas when the first column is materialized. Scripts that only read the data can
+use it instead of utils, which imports pandas and the geocoding code.
+"""
+
+import hashlib
+import inspect
+import os
+import pickle
+from instrument import timed
+
+DATA_PATH = "fatal-police-shootings-data-coordinates.feather"
+
+
+def file_hash(path):
+    """
+    SHA-1 of a file's contents, used to tell when caches built from it are out of date
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def code_source(item):
+    """
+    Source of a function, or repr of a constant, for hashing code into cache keys
+    """
+    return inspect.getsource(item) if callable(item) else repr(item)
+
+
+def cache_path_for(data_path, suffix):
+    """
+    Path of a cache that belongs to a data file
+
+    Args:
+        data_path: Path to Feather file written by utils.serialize_data
+        suffix: What to replace the extension with, e.g. "-cube.feather"
+    Returns:
+        Path next to the data file, e.g. data.feather -> data-cube.feather
+    """
+    return os.path.splitext(data_path)[0] + suffix
+
+
+def load_cached(data_path, suffix, build, sources=(), rebuild=False):
+    """
+    Load something derived from a data file, building and caching it if the data changed
+
+    The result is saved next to the data file (see cache_path_for) together with the hash of
+    the files it was built from, so it is rebuilt automatically whenever one of them is
+    rewritten. Dataframes go in a memory-mapped Feather file when the suffix ends in
+    .feather, anything else is pickled. The file is written to a temporary path first and
+    then moved into place, so readers never see half of it.
+
+    Args:
+        data_path: Path to Feather file written by utils.serialize_data
+        suffix: Suffix of the cache file, see cache_path_for
+        build: Function without arguments that builds the result
+        sources: Other files the result depends on, their hashes are part of the key too
+        rebuild: If True ignore the cached result
+    Returns:
+        Cached result, or the result of build()
+    """
+    path = cache_path_for(data_path, suffix)
+    source_hash = "".join(file_hash(source) for source in [data_path] + list(sources))
+    as_feather = path.endswith(".feather")
+    if as_feather:
+        from pyarrow import feather
+        import pyarrow as pa
+
+    if not rebuild and os.path.exists(path):
+        if as_feather:
+            table = feather.read_table(path, memory_map=True)
+            if (table.schema.metadata or {}).get(b'source_hash') == source_hash.encode('utf-8'):
+                return table.to_pandas()
+        else:
+            with open(path, 'rb') as f:
+                cached_hash, result = pickle.load(f)
+            if cached_hash == source_hash:
+                return result
+    result = build()
+    temp_path = path + ".tmp"
+    if as_feather:
+        table = pa.Table.from_pandas(result, preserve_index=False)
+        table = table.replace_schema_metadata(dict(table.schema.metadata or {},
+                                                   source_hash=source_hash.encode('utf-8')))
+        feather.write_feather(table, temp_path, compression='uncompressed')
+    else:
+        with open(temp_path, 'wb') as f:
+            pickle.dump((source_hash, result), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)
+    return result
+
+
+def read_table(path=DATA_PATH, columns=None, rows=None):
+    """
+    Memory-map a stored dataset as an Arrow table without converting it to pandas
+
+    Args:
+        path: Path to Feather file written by utils.serialize_data
+        columns: Optional list of columns to keep, all columns if None
+        rows: Optional (start, stop) tuple of the row range to keep, all rows if None
+    Returns:
+        Tuple of (pyarrow Table, index of its first row)
+    """
+    import pyarrow as pa
+
+    # Uncompressed Feather v2 files are Arrow IPC files, so reading them is just mapping buffers
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    if columns is not None:
+        table = table.select(columns)
+    start = 0
+    if rows is not None:
+        start, stop = rows
+        start = max(start, 0)
+        table = table.slice(start, max(min(stop, table.num_rows) - start, 0))
+    return table, start
+
+
+class LazyFrame(object):
+    """
+    Column-on-demand view of a stored dataset
+
+    Columns stay in the memory-mapped file until they are first accessed, then they are
+    converted to pandas Series (with the stored categoricals, nullable types, etc) and
+    kept. data['state'] returns a Series, data[['state', 'race']] a DataFrame and
+    to_pandas() the whole frame, the same as utils.load_data would.
+
+    Args:
+        table: pyarrow Table from read_table
+        start: Index of the table's first row
+    """
+
+    def __init__(self, table, start=0):
+        self.table = table
+        self.start = start
+        self.cache = {}
+
+    @property
+    def columns(self):
+        return list(self.table.column_names)
+
+    @property
+    def shape(self):
+        return (self.table.num_rows, self.table.num_columns)
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def __contains__(self, column):
+        return column in self.table.column_names
+
+    def __repr__(self):
+        return "<LazyFrame %d rows x %d columns, %d loaded>" % (self.shape + (len(self.cache),))
+
+    def _index(self):
+        import pandas as pd
+
+        return pd.RangeIndex(self.start, self.start + self.table.num_rows)
+
+    def __getitem__(self, key):
+        if isinstance(key, (list, tuple)):
+            import pandas as pd
+
+            return pd.DataFrame({column: self[column] for column in key}, index=self._index())
+        if key not in self.cache:
+            if key not in self.table.column_names:
+                raise KeyError(key)
+            series = self.table.select([key]).to_pandas()[key]
+            series.index = self._index()
+            self.cache[key] = series
+        return self.cache[key]
+
+    def to_pandas(self):
+        """
+        Materialize every column as a pandas DataFrame
+        """
+        return self[self.columns]
+
+
+@timed
+def load_data(path=DATA_PATH, columns=None, rows=None, lazy=False):
+    """
+    Load in previously serialized data
+
+    Args:
+        path: Path to Feather file written by utils.serialize_data
+        columns: Optional list of columns to load, all columns if None
+        rows: Optional (start, stop) tuple of the row range to load, all rows if None
+        lazy: If True return a LazyFrame that converts columns only when they are used
+    Returns:
+        Pandas dataframe (or LazyFrame) containing original data plus latitude/longitude data
+    """
+    table, start = read_table(path, columns, rows)
+    if lazy:
+        return LazyFrame(table, start)
+    data = table.to_pandas()
+    if rows is not None:
+        import pandas as pd
+
+        data.index = pd.RangeIndex(start, start + len(data))
+    return data
@@ -1,9 +1,31 @@
 #!/usr/bin/env python
 
-from geopy.geocoders import Nominatim
-import time
+import os
 import numpy as np
 import pandas as pd
+from gazetteer import GazetteerBackend, GAZETTEER_PATH
+from geocache import GeocodeCache, GEOCODE_CACHE_PATH
+from geocoding import GeocodingEngine, NominatimBackend
+from instrument import METRICS, timed
+# Read path, kept importable on its own for scripts that only load the data
+from store import DATA_PATH, file_hash, load_data
+
+CSV_PATH = "fatal-police-shootings-data.csv"
+OVERRIDES_PATH = "coordinate-overrides.csv"
+
+# Column types of the WaPo CSV, dates are parsed separately
+SCHEMA = {'id': 'int32', 'name': 'string', 'manner_of_death': 'category', 'armed': 'category',
+          'age': 'UInt8', 'gender': 'category', 'race': 'category', 'city': 'string',
+          'state': 'category', 'signs_of_mental_illness': 'boolean', 'threat_level': 'category',
+          'flee': 'category', 'body_camera': 'boolean'}
+DATE_COLUMNS = ['date']
+CATEGORICAL_COLUMNS = [column for column, dtype in SCHEMA.items() if dtype == 'category'] + ['common_armed']
+
+# Typos in the WaPo city names, see DataPreparation.ipynb for the articles confirming each fix
+CITY_NAME_FIXES = {('Jacksonsville', 'FL'): 'Jacksonville', ('Frederickstown', 'WA'): 'Frederickson',
+                   ('Rudioso', 'NM'): 'Ruidoso', ('Haynesville', 'AL'): 'Hayneville',
+                   ('Philadephia', 'PA'): 'Philadelphia', ('Joilet', 'IL'): 'Joliet',
+                   ('Rangley', 'CO'): 'Rangely', ('Scarbo', 'WV'): 'Scarbro'}
 
 STATE_MAPPINGS = {'CA': 'California', 'TX': 'Texas', 'FL': 'Florida',
                   'AZ': 'Arizona', 'CO': 'Colorado', 'GA': 'Georgia',
@@ -24,269 +46,204 @@ STATE_MAPPINGS = {'CA': 'California', 'TX': 'Texas', 'FL': 'Florida',
                   'ND': 'North Dakota', 'VT': 'Vermont', 'RI': 'Rhode Island'}
 
 
-def get_coordinates(data):
+def _pair_positions(index, data):
     """
-    Use geocoding to get lat/lon coordinates from city, state
+    Position of each row's city/state pair in a (city, state) index, -1 for pairs not in the
+    index and rows with a missing city or state. Appending a NaN to the looked up values
+    lets the -1 positions pick it up
+    """
+    return index.get_indexer(pd.MultiIndex.from_arrays([data['city'], data['state']]))
+
+
+@timed
+def read_data(path=CSV_PATH, report=False):
+    """
+    Read the WaPo CSV with an explicit memory efficient schema
+
+    Low-cardinality text columns become categoricals, age a nullable 8 bit integer, the
+    flags nullable booleans and dates are parsed while reading.
 
     Args:
-        data: Pandas dataframe of WaPo dataset
+        path: Path to WaPo CSV
+        report: If True also read the CSV with default types and print memory usage of both
     Returns:
-        Original dataframe with 2 extra latitude/longitude columns
+        Pandas dataframe of WaPo dataset
     """
-    # Restrict geocoding to recognize locations ONLY in USA
-    geolocator = Nominatim(format_string="%s, United States of America", user_agent="my-application")
-
-    coordinates = {}
-    cities_skip = []
-    for (city, state), row in data.groupby(['city', 'state']):
-        city_state = "%s, %s" % (city, STATE_MAPPINGS[state])
-        if city_state in cities_skip:
-            latitude = np.nan
-            longitude = np.nan
-        else:
-            try:
-                _, (latitude, longitude) = geolocator.geocode(city_state, timeout=5)
-            # If address cannot be found, set it to NaN and find coordinates manually
-            except:
-                print("Error", city_state)
-                cities_skip.append(city_state)
-                latitude = np.nan
-                longitude = np.nan
-        # Uodate city_state var to have original state abbr. (CA instead of California)
-        city_state = "%s, %s" % (city, state)
-        coordinates[city_state] = [latitude, longitude]
-        # Sleep to avoid sending too many requests to Nominatim servers at once
-        time.sleep(1)
-    # Iterate over dictionary and assign coordinates to correct city/state pair
-    for city_state in coordinates.keys():
-        latitude = coordinates[city_state][0]
-        longitude = coordinates[city_state][1]
-        city, state = [x.strip() for x in city_state.split(',')]
-        data.loc[(data['city'] == city) & (data['state'] == state), 'lat'] = latitude
-        data.loc[(data['city'] == city) & (data['state'] == state), 'lon'] = longitude
+    data = pd.read_csv(path, dtype=SCHEMA, parse_dates=DATE_COLUMNS)
+    if report:
+        before = pd.read_csv(path).memory_usage(deep=True).sum()
+        after = data.memory_usage(deep=True).sum()
+        print("Memory usage: %.2f MB with default types, %.2f MB with schema (%.1fx smaller)" %
+              (before / 1e6, after / 1e6, before / after))
     return data
 
 
-def add_coordinates(data):
+@timed
+def fix_city_names(data, fixes=CITY_NAME_FIXES):
     """
-    Add coordinates to cities that weren't geocoded
+    Fix misspelled city names
 
     Args:
-        data: Pandas DataFrame containing original data and lat/lon data
+        data: Pandas dataframe of WaPo dataset
+        fixes: Dictionary mapping (city, state) tuples to the correct city name
     Returns:
-        None, but the original data is updated with new coordinates
+        None, but the original data is updated with fixed city names
     """
-    # Update NaN lat/lon values with actual coordinates
-    data.loc[(data['city'] == "Maricopa") & (data['state'] == "AZ"), 'lat'] = 33.058106
-    data.loc[(data['city'] == "Maricopa") & (data['state'] == "AZ"), 'lon'] = -112.047642
-
-    data.loc[(data['city'] == "Eaton Rapids Township") & (data['state'] == "MI"), 'lat'] = 42.568147
-    data.loc[(data['city'] == "Eaton Rapids Township") & (data['state'] == "MI"), 'lon'] = -84.752448
-
-    data.loc[(data['city'] == "Green Bay") & (data['state'] == "WI"), 'lat'] = 44.513319
-    data.loc[(data['city'] == "Green Bay") & (data['state'] == "WI"), 'lon'] = -88.013296
-
-    data.loc[(data['city'] == "Roxand Township") & (data['state'] == "MI"), 'lat'] = 42.729993
-    data.loc[(data['city'] == "Roxand Township") & (data['state'] == "MI"), 'lon'] = -84.877639
-
-    data.loc[(data['city'] == "San Antonio") & (data['state'] == "TX"), 'lat'] = 29.424122
-    data.loc[(data['city'] == "San Antonio") & (data['state'] == "TX"), 'lon'] = -98.493628
-
-    data.loc[(data['city'] == "Red Valley") & (data['state'] == "AZ"), 'lat'] = 36.603994
-    data.loc[(data['city'] == "Red Valley") & (data['state'] == "AZ"), 'lon'] = -109.060383
-
-    data.loc[(data['city'] == "Straban Township") & (data['state'] == "PA"), 'lat'] = 39.871606
-    data.loc[(data['city'] == "Straban Township") & (data['state'] == "PA"), 'lon'] = -77.173531
-
-    data.loc[(data['city'] == "South El Monte") & (data['state'] == "CA"), 'lat'] = 34.051955
-    data.loc[(data['city'] == "South El Monte") & (data['state'] == "CA"), 'lon'] = -118.046734
-
-    data.loc[(data['city'] == "St. Petersburg") & (data['state'] == "FL"), 'lat'] = 27.767601
-    data.loc[(data['city'] == "St. Petersburg") & (data['state'] == "FL"), 'lon'] = -82.640291
-
-    data.loc[(data['city'] == "Watsonsville") & (data['state'] == "CA"), 'lat'] = 36.910231
-    data.loc[(data['city'] == "Watsonsville") & (data['state'] == "CA"), 'lon'] = -121.756895
-
-    data.loc[(data['city'] == "Pinion Hills") & (data['state'] == "CA"), 'lat'] = 34.433237
-    data.loc[(data['city'] == "Pinion Hills") & (data['state'] == "CA"), 'lon'] = -117.646792
-
-    data.loc[(data['city'] == "Palm Beach Gardens") & (data['state'] == "FL"), 'lat'] = 26.823395
-    data.loc[(data['city'] == "Palm Beach Gardens") & (data['state'] == "FL"), 'lon'] = -80.138655
-
-    data.loc[(data['city'] == "West Goshen") & (data['state'] == "CA"), 'lat'] = 36.351062
-    data.loc[(data['city'] == "West Goshen") & (data['state'] == "CA"), 'lon'] = -119.420120
-
-    data.loc[(data['city'] == "North Laredo") & (data['state'] == "TX"), 'lat'] = 27.530567
-    data.loc[(data['city'] == "North Laredo") & (data['state'] == "TX"), 'lon'] = -99.480324
-
-    data.loc[(data['city'] == "Mountain Pine") & (data['state'] == "AR"), 'lat'] = 34.572035
-    data.loc[(data['city'] == "Mountain Pine") & (data['state'] == "AR"), 'lon'] = -93.173240
-
-    data.loc[(data['city'] == "South Greensburg") & (data['state'] == "PA"), 'lat'] = 40.278403
-    data.loc[(data['city'] == "South Greensburg") & (data['state'] == "PA"), 'lon'] = -79.544762
-
-    data.loc[(data['city'] == "Pueblo of Laguna") & (data['state'] == "NM"), 'lat'] = 35.035654
-    data.loc[(data['city'] == "Pueblo of Laguna") & (data['state'] == "NM"), 'lon'] = -107.386223
-
-    data.loc[(data['city'] == "Benton") & (data['state'] == "IL"), 'lat'] = 37.996716
-    data.loc[(data['city'] == "Benton") & (data['state'] == "IL"), 'lon'] = -88.920069
-
-    data.loc[(data['city'] == "Fayetteville") & (data['state'] == "AR"), 'lat'] = 36.082156
-    data.loc[(data['city'] == "Fayetteville") & (data['state'] == "AR"), 'lon'] = -94.171854
-
-    data.loc[(data['city'] == "El Paso") & (data['state'] == "TX"), 'lat'] = 31.761878
-    data.loc[(data['city'] == "El Paso") & (data['state'] == "TX"), 'lon'] = -106.485022
-
-    data.loc[(data['city'] == "St. Martin") & (data['state'] == "MS"), 'lat'] = 30.437976
-    data.loc[(data['city'] == "St. Martin") & (data['state'] == "MS"), 'lon'] = -88.868085
-
-    data.loc[(data['city'] == "Jacksonville") & (data['state'] == "FL"), 'lat'] = 30.332184
-    data.loc[(data['city'] == "Jacksonville") & (data['state'] == "FL"), 'lon'] = -81.655651
-
-    data.loc[(data['city'] == "Lake Asbury") & (data['state'] == "FL"), 'lat'] = 30.049129
-    data.loc[(data['city'] == "Lake Asbury") & (data['state'] == "FL"), 'lon'] = -81.821487
-
-    data.loc[(data['city'] == "Lake City") & (data['state'] == "SC"), 'lat'] = 33.870996
-    data.loc[(data['city'] == "Lake City") & (data['state'] == "SC"), 'lon'] = -79.755345
-
-    data.loc[(data['city'] == "McKinneyville") & (data['state'] == "CA"), 'lat'] = 40.946515
-    data.loc[(data['city'] == "McKinneyville") & (data['state'] == "CA"), 'lon'] = -124.100620
-
-    data.loc[(data['city'] == "East Hollywood") & (data['state'] == "CA"), 'lat'] = 34.091341
-    data.loc[(data['city'] == "East Hollywood") & (data['state'] == "CA"), 'lon'] = -118.293589
-
-    data.loc[(data['city'] == "Weeki Wachi") & (data['state'] == "FL"), 'lat'] = 28.515551
-    data.loc[(data['city'] == "Weeki Wachi") & (data['state'] == "FL"), 'lon'] = -82.572877
-
-    data.loc[(data['city'] == "Logan Canyon") & (data['state'] == "UT"), 'lat'] = 41.740209
-    data.loc[(data['city'] == "Logan Canyon") & (data['state'] == "UT"), 'lon'] = -111.793831
-
-    data.loc[(data['city'] == "Springdale") & (data['state'] == "AR"), 'lat'] = 36.186744
-    data.loc[(data['city'] == "Springdale") & (data['state'] == "AR"), 'lon'] = -94.128814
-
-    data.loc[(data['city'] == "Muckleshoot Indian Reservation") & (data['state'] == "WA"), 'lat'] = 47.251720
-    data.loc[(data['city'] == "Muckleshoot Indian Reservation") & (data['state'] == "WA"), 'lon'] = -122.115322
-
-    data.loc[(data['city'] == "North St. Louis") & (data['state'] == "MO"), 'lat'] = 38.606842
-    data.loc[(data['city'] == "North St. Louis") & (data['state'] == "MO"), 'lon'] = -90.250129
-
-    data.loc[(data['city'] == "Simpsonsville") & (data['state'] == "KY"), 'lat'] = 38.222570
-    data.loc[(data['city'] == "Simpsonsville") & (data['state'] == "KY"), 'lon'] = -85.355235
-
-    data.loc[(data['city'] == "Forks Township") & (data['state'] == "PA"), 'lat'] = 40.734543
-    data.loc[(data['city'] == "Forks Township") & (data['state'] == "PA"), 'lon'] = -75.212900
-
-    data.loc[(data['city'] == "Lancaster City") & (data['state'] == "PA"), 'lat'] = 40.037875
-    data.loc[(data['city'] == "Lancaster City") & (data['state'] == "PA"), 'lon'] = -76.305514
-
-    data.loc[(data['city'] == "Golden Shores") & (data['state'] == "AZ"), 'lat'] = 34.786283
-    data.loc[(data['city'] == "Golden Shores") & (data['state'] == "AZ"), 'lon'] = -114.474120
-
-    data.loc[(data['city'] == "Grand Prarie") & (data['state'] == "TX"), 'lat'] = 32.745964
-    data.loc[(data['city'] == "Grand Prarie") & (data['state'] == "TX"), 'lon'] = -96.997785
-
-    data.loc[(data['city'] == "Corning") & (data['state'] == "WI"), 'lat'] = 45.261851
-    data.loc[(data['city'] == "Corning") & (data['state'] == "WI"), 'lon'] = -89.962337
-
-    data.loc[(data['city'] == "Barona Indian Reservation") & (data['state'] == "CA"), 'lat'] = 32.946258
-    data.loc[(data['city'] == "Barona Indian Reservation") & (data['state'] == "CA"), 'lon'] = -116.861586
-
-    data.loc[(data['city'] == "Lower Mount Bethel") & (data['state'] == "PA"), 'lat'] = 40.807747
-    data.loc[(data['city'] == "Lower Mount Bethel") & (data['state'] == "PA"), 'lon'] = -75.166212
-
-    data.loc[(data['city'] == "Franklin") & (data['state'] == "TN"), 'lat'] = 35.925064
-    data.loc[(data['city'] == "Franklin") & (data['state'] == "TN"), 'lon'] = -86.868890
-
-    data.loc[(data['city'] == "Crescent City") & (data['state'] == "FL"), 'lat'] = 29.430251
-    data.loc[(data['city'] == "Crescent City") & (data['state'] == "FL"), 'lon'] = -81.510629
-
-    data.loc[(data['city'] == "North Branch") & (data['state'] == "MN"), 'lat'] = 45.510213
-    data.loc[(data['city'] == "North Branch") & (data['state'] == "MN"), 'lon'] = -92.993105
-
-    data.loc[(data['city'] == "Saginaw") & (data['state'] == "MI"), 'lat'] = 43.419470
-    data.loc[(data['city'] == "Saginaw") & (data['state'] == "MI"), 'lon'] = -83.950807
-
-    data.loc[(data['city'] == "Blue Summit") & (data['state'] == "MO"), 'lat'] = 39.088673
-    data.loc[(data['city'] == "Blue Summit") & (data['state'] == "MO"), 'lon'] = -94.481243
-
-    data.loc[(data['city'] == "Frederickstown") & (data['state'] == "WA"), 'lat'] = 39.365658
-    data.loc[(data['city'] == "Frederickstown") & (data['state'] == "WA"), 'lon'] = -75.882690
-
-    data.loc[(data['city'] == "Watagua") & (data['state'] == "TX"), 'lat'] = 32.857906
-    data.loc[(data['city'] == "Watagua") & (data['state'] == "TX"), 'lon'] = -97.254737
-
-    data.loc[(data['city'] == "Columbua") & (data['state'] == "IN"), 'lat'] = 39.201440
-    data.loc[(data['city'] == "Columbua") & (data['state'] == "IN"), 'lon'] = -85.921380
-
-    data.loc[(data['city'] == "Canton Township") & (data['state'] == "PA"), 'lat'] = 40.218128
-    data.loc[(data['city'] == "Canton Township") & (data['state'] == "PA"), 'lon'] = -80.310168
-
-    data.loc[(data['city'] == "Fort Smith") & (data['state'] == "OK"), 'lat'] = 35.385924
-    data.loc[(data['city'] == "Fort Smith") & (data['state'] == "OK"), 'lon'] = -94.398548
-
-    data.loc[(data['city'] == "Standing Rock Reservation") & (data['state'] == "ND"), 'lat'] = 45.750275
-    data.loc[(data['city'] == "Standing Rock Reservation") & (data['state'] == "ND"), 'lon'] = -101.200415
-
-    data.loc[(data['city'] == "300 block of State Line Road") & (data['state'] == "TN"), 'lat'] = 36.502580
-    data.loc[(data['city'] == "300 block of State Line Road") & (data['state'] == "TN"), 'lon'] = -88.743449
-
-    data.loc[(data['city'] == "Blackman Township") & (data['state'] == "MI"), 'lat'] = 42.279917
-    data.loc[(data['city'] == "Blackman Township") & (data['state'] == "MI"), 'lon'] = -84.459270
-
-    data.loc[(data['city'] == "Lone Rock") & (data['state'] == "AR"), 'lat'] = 36.180625
-    data.loc[(data['city'] == "Lone Rock") & (data['state'] == "AR"), 'lon'] = -92.344602
-
-    data.loc[(data['city'] == "Lower Macungie Township") & (data['state'] == "PA"), 'lat'] = 40.540989
-    data.loc[(data['city'] == "Lower Macungie Township") & (data['state'] == "PA"), 'lon'] = -75.562604
-
-    data.loc[(data['city'] == "Hackett") & (data['state'] == "AR"), 'lat'] = 35.190373
-    data.loc[(data['city'] == "Hackett") & (data['state'] == "AR"), 'lon'] = -94.411049
-
-    data.loc[(data['city'] == "Cottonwood") & (data['state'] == "AZ"), 'lat'] = 34.739188
-    data.loc[(data['city'] == "Cottonwood") & (data['state'] == "AZ"), 'lon'] = -112.009879
-
-    data.loc[(data['city'] == "Tiverton") & (data['state'] == "RI"), 'lat'] = 41.625921
-    data.loc[(data['city'] == "Tiverton") & (data['state'] == "RI"), 'lon'] = -71.213423
-
-    data.loc[(data['city'] == "Poway") & (data['state'] == "CA"), 'lat'] = 32.962823
-    data.loc[(data['city'] == "Poway") & (data['state'] == "CA"), 'lon'] = -117.035865
-
-    data.loc[(data['city'] == "Kenner") & (data['state'] == "LA"), 'lat'] = 29.994092
-    data.loc[(data['city'] == "Kenner") & (data['state'] == "LA"), 'lon'] = -90.241743
-
-    data.loc[(data['city'] == "Okmulgee County") & (data['state'] == "OK"), 'lat'] = 35.679587
-    data.loc[(data['city'] == "Okmulgee County") & (data['state'] == "OK"), 'lon'] = -95.983258
+    lookup = pd.Series(list(fixes.values()), index=pd.MultiIndex.from_tuples(list(fixes.keys())), dtype=object)
+    positions = _pair_positions(lookup.index, data)
+    matched = positions >= 0
+    if not matched.any():
+        return
+    fixed = lookup.to_numpy()[positions[matched]]
+    if isinstance(data['city'].dtype, pd.CategoricalDtype):
+        new_names = sorted(set(fixed) - set(data['city'].cat.categories))
+        data['city'] = data['city'].cat.add_categories(new_names)
+    data.loc[matched, 'city'] = fixed
+    if isinstance(data['city'].dtype, pd.CategoricalDtype):
+        data['city'] = data['city'].cat.remove_unused_categories()
+
+
+@timed
+def get_coordinates(data, cache_path=GEOCODE_CACHE_PATH, max_age=None, offline=False, backend=None,
+                    gazetteer_path=GAZETTEER_PATH):
+    """
+    Use geocoding to get lat/lon coordinates from city, state
 
-    data.loc[(data['city'] == "Homestead") & (data['state'] == "FL"), 'lat'] = 25.468722
-    data.loc[(data['city'] == "Homestead") & (data['state'] == "FL"), 'lon'] = -80.477557
+    Pairs are first looked up by exact name in the offline gazetteer index (if it exists),
+    then in the persistent geocode cache, so only city/state pairs that have never been seen
+    before are sent to the geocoding backend. Pairs that are still unresolved fall back to
+    the closest gazetteer spelling, these are printed and counted in gazetteer_fuzzy_total
+    so they can be reviewed.
 
-    data.loc[(data['city'] == "Antioch") & (data['state'] == "TN"), 'lat'] = 36.059718
-    data.loc[(data['city'] == "Antioch") & (data['state'] == "TN"), 'lon'] = -86.671595
+    Args:
+        data: Pandas dataframe of WaPo dataset
+        cache_path: Path to SQLite geocode cache
+        max_age: Optional age in seconds after which cached entries are geocoded again
+        offline: If True never contact the backend, pairs missing from cache get NaN
+        backend: geocoding.Backend instance, defaults to the public Nominatim server
+        gazetteer_path: Path to gazetteer index built with GazetteerBackend.build, None to skip it
+    Returns:
+        Original dataframe with 2 extra latitude/longitude columns
+    """
+    pairs = list(data.groupby(['city', 'state'], observed=True).groups.keys())
+    coordinates = {}
+    gazetteer = None
+    if gazetteer_path is not None and os.path.exists(gazetteer_path):
+        gazetteer = GazetteerBackend(gazetteer_path)
+        cities, states = zip(*pairs) if pairs else ((), ())
+        lats, lons = gazetteer.lookup_many(cities, states, fuzzy=False)
+        coordinates = {pair: (lat, lon) for pair, lat, lon in zip(pairs, lats, lons) if not np.isnan(lat)}
+        METRICS.count('gazetteer_hits_total', len(coordinates))
+        METRICS.count('gazetteer_misses_total', len(pairs) - len(coordinates))
+    with GeocodeCache(cache_path, max_age=max_age) as cache:
+        coordinates.update(cache.get_many([pair for pair in pairs if pair not in coordinates]))
+        missing = [pair for pair in pairs if pair not in coordinates]
+        if missing and not offline:
+            if backend is None:
+                backend = NominatimBackend(STATE_MAPPINGS)
+            engine = GeocodingEngine(backend)
+            for (city, state), location, error in engine.geocode_iter(missing):
+                if error is not None:
+                    # Don't cache request failures (timeouts, etc) so they are retried next time
+                    print("Error", "%s, %s" % (city, state), error)
+                    continue
+                # If address cannot be found, record it as a miss and find coordinates manually
+                if location is None:
+                    print("Not found", "%s, %s" % (city, state))
+                    location = (np.nan, np.nan)
+                cache.put(city, state, *location)
+                coordinates[(city, state)] = location
+    # A close spelling in the gazetteer is only trusted once the cache and backend came up empty
+    unresolved = [pair for pair in pairs if pair not in coordinates or np.isnan(coordinates[pair][0])]
+    if gazetteer is not None and unresolved:
+        cities, states = zip(*unresolved)
+        lats, lons = gazetteer.lookup_many(cities, states)
+        for pair, lat, lon in zip(unresolved, lats, lons):
+            if not np.isnan(lat):
+                print("Fuzzy match", "%s, %s" % pair, (float(lat), float(lon)))
+                METRICS.count('gazetteer_fuzzy_total')
+                coordinates[pair] = (lat, lon)
+    return assign_coordinates(data, coordinates)
+
+
+@timed
+def assign_coordinates(data, coordinates):
+    """
+    Assign lat/lon values to every row of the dataframe in one vectorized join
 
-    data.loc[(data['city'] == "Naples") & (data['state'] == "FL"), 'lat'] = 26.142036
-    data.loc[(data['city'] == "Naples") & (data['state'] == "FL"), 'lon'] = -81.794810
+    Args:
+        data: Pandas dataframe of WaPo dataset
+        coordinates: Dictionary mapping (city, state) tuples to [latitude, longitude]
+    Returns:
+        Original dataframe with lat/lon columns filled in, rows with a city/state
+        pair missing from coordinates get NaN
+    """
+    lookup = pd.DataFrame([(city, state, lat, lon) for (city, state), (lat, lon) in coordinates.items()],
+                          columns=['city', 'state', 'lat', 'lon']).set_index(['city', 'state'])
+    positions = _pair_positions(lookup.index, data)
+    for column in ['lat', 'lon']:
+        data[column] = np.append(lookup[column].to_numpy(dtype=float), np.nan)[positions]
+    return data
 
-    data.loc[(data['city'] == "Knox") & (data['state'] == "IN"), 'lat'] = 41.295875
-    data.loc[(data['city'] == "Knox") & (data['state'] == "IN"), 'lon'] = -86.625014
 
-    data.loc[(data['city'] == "Monroe") & (data['state'] == "NC"), 'lat'] = 34.985428
-    data.loc[(data['city'] == "Monroe") & (data['state'] == "NC"), 'lon'] = -80.549511
+def load_overrides(path=OVERRIDES_PATH, kind=None):
+    """
+    Load the table of manually looked up coordinates
 
-    data.loc[(data['city'] == "North Shore") & (data['state'] == "HI"), 'lat'] = 21.561657
-    data.loc[(data['city'] == "North Shore") & (data['state'] == "HI"), 'lon'] = -158.071598
+    Args:
+        path: Path to CSV with city, state, lat, lon, kind and reason columns
+        kind: Optional override kind to keep ("missing" or "fix"), all rows if None
+    Returns:
+        Pandas dataframe of coordinate overrides
+    """
+    overrides = pd.read_csv(path, dtype={'city': str, 'state': str, 'lat': float, 'lon': float})
+    if kind is not None:
+        overrides = overrides.loc[overrides['kind'] == kind].reset_index(drop=True)
+    duplicated = overrides.duplicated(['city', 'state'], keep=False)
+    if duplicated.any():
+        pairs = overrides.loc[duplicated, ['city', 'state']].drop_duplicates()
+        raise ValueError("Duplicate coordinate overrides for: %s" %
+                         ", ".join("%s, %s" % tuple(pair) for pair in pairs.values))
+    return overrides
+
+
+@timed
+def apply_overrides(data, overrides=None, kind=None, path=OVERRIDES_PATH):
+    """
+    Overwrite lat/lon values of every city/state pair found in the override table
 
-    data.loc[(data['city'] == "Ruidoso") & (data['state'] == "NM"), 'lat'] = 33.332161
-    data.loc[(data['city'] == "Ruidoso") & (data['state'] == "NM"), 'lon'] = -105.674881
+    Args:
+        data: Pandas DataFrame containing original data and lat/lon data
+        overrides: Dataframe from load_overrides, loaded from path if None
+        kind: Optional override kind to apply ("missing" or "fix"), all rows if None
+        path: Path to override table, used when overrides is None
+    Returns:
+        Dataframe of overrides that didn't match any row in the data. The original
+        data is updated in place
+    """
+    if overrides is None:
+        overrides = load_overrides(path, kind=kind)
+    elif kind is not None:
+        overrides = overrides.loc[overrides['kind'] == kind].reset_index(drop=True)
+    lookup = overrides.set_index(['city', 'state'])
+    positions = _pair_positions(lookup.index, data)
+    matched = positions >= 0
+    for column in ['lat', 'lon']:
+        data.loc[matched, column] = lookup[column].to_numpy()[positions[matched]]
+    return overrides.loc[~overrides.index.isin(np.unique(positions[matched]))]
 
-    data.loc[(data['city'] == "Scarbo") & (data['state'] == "WV"), 'lat'] = 37.952240
-    data.loc[(data['city'] == "Scarbo") & (data['state'] == "WV"), 'lon'] = -81.164619
 
-    data.loc[(data['city'] == "Clear Creek Canyon") & (data['state'] == "CO"), 'lat'] = 39.629370
-    data.loc[(data['city'] == "Clear Creek Canyon") & (data['state'] == "CO"), 'lon'] = -105.395600
+def add_coordinates(data):
+    """
+    Add coordinates to cities that weren't geocoded
 
-    data.loc[(data['city'] == "Bristol") & (data['state'] == "VA"), 'lat'] = 36.615100
-    data.loc[(data['city'] == "Bristol") & (data['state'] == "VA"), 'lon'] = -82.172290
-    return
+    Args:
+        data: Pandas DataFrame containing original data and lat/lon data
+    Returns:
+        None, but the original data is updated with new coordinates
+    """
+    # Update NaN lat/lon values with actual coordinates
+    apply_overrides(data, kind='missing')
 
 
 def fix_coordinates(data):
@@ -299,244 +256,161 @@ def fix_coordinates(data):
         None, but the original data is updated with fixed coordinates
     """
     # Fix incorrect coordinates
-    data.loc[(data['city'] == "South Gate") & (data['state'] == "CA"), 'lat'] = 33.954737
-    data.loc[(data['city'] == "South Gate") & (data['state'] == "CA"), 'lon'] = -118.212016
-
-    data.loc[(data['city'] == "Westminister") & (data['state'] == "CO"), 'lat'] = 39.836653
-    data.loc[(data['city'] == "Westminister") & (data['state'] == "CO"), 'lon'] = -105.037205
-
-    data.loc[(data['city'] == "Sylvania Township") & (data['state'] == "OH"), 'lat'] = 41.689896
-    data.loc[(data['city'] == "Sylvania Township") & (data['state'] == "OH"), 'lon'] = -83.741163
-
-    data.loc[(data['city'] == "Colebrook Township") & (data['state'] == "OH"), 'lat'] = 41.535773
-    data.loc[(data['city'] == "Colebrook Township") & (data['state'] == "OH"), 'lon'] = -80.762615
-
-    data.loc[(data['city'] == "Nevada") & (data['state'] == "MO"), 'lat'] = 37.839205
-    data.loc[(data['city'] == "Nevada") & (data['state'] == "MO"), 'lon'] = -94.354672
-
-    data.loc[(data['city'] == "Big Bear") & (data['state'] == "MO"), 'lat'] = 36.556754
-    data.loc[(data['city'] == "Big Bear") & (data['state'] == "MO"), 'lon'] = -93.271757
-
-    data.loc[(data['city'] == "Buffalo") & (data['state'] == "MO"), 'lat'] = 37.643929
-    data.loc[(data['city'] == "Buffalo") & (data['state'] == "MO"), 'lon'] = -93.092409
-
-    data.loc[(data['city'] == "Aurora") & (data['state'] == "MO"), 'lat'] = 36.970891
-    data.loc[(data['city'] == "Aurora") & (data['state'] == "MO"), 'lon'] = -93.717979
-
-    data.loc[(data['city'] == "Lebanon") & (data['state'] == "MO"), 'lat'] = 37.680597
-    data.loc[(data['city'] == "Lebanon") & (data['state'] == "MO"), 'lon'] = -92.663787
-
-    data.loc[(data['city'] == "Vancouver") & (data['state'] == "WA"), 'lat'] = 45.635515
-    data.loc[(data['city'] == "Vancouver") & (data['state'] == "WA"), 'lon'] = -122.557830
-
-    data.loc[(data['city'] == "Ridgefield") & (data['state'] == "WA"), 'lat'] = 45.815695
-    data.loc[(data['city'] == "Ridgefield") & (data['state'] == "WA"), 'lon'] = -122.702895
-
-    data.loc[(data['city'] == "Des Moines") & (data['state'] == "WA"), 'lat'] = 47.401766
-    data.loc[(data['city'] == "Des Moines") & (data['state'] == "WA"), 'lon'] = -122.324290
-
-    data.loc[(data['city'] == "Rochester") & (data['state'] == "WA"), 'lat'] = 46.828064
-    data.loc[(data['city'] == "Rochester") & (data['state'] == "WA"), 'lon'] = -123.075530
-
-    data.loc[(data['city'] == "Beaver") & (data['state'] == "WA"), 'lat'] = 48.057425
-    data.loc[(data['city'] == "Beaver") & (data['state'] == "WA"), 'lon'] = -124.347757
-
-    data.loc[(data['city'] == "Frederickson") & (data['state'] == "WA"), 'lat'] = 47.096211
-    data.loc[(data['city'] == "Frederickson") & (data['state'] == "WA"), 'lon'] = -122.358731
-
-    data.loc[(data['city'] == "West Knox") & (data['state'] == "TN"), 'lat'] = 35.970360
-    data.loc[(data['city'] == "West Knox") & (data['state'] == "TN"), 'lon'] = -83.955185
-
-    data.loc[(data['city'] == "Washington Park") & (data['state'] == "IL"), 'lat'] = 38.635050
-    data.loc[(data['city'] == "Washington Park") & (data['state'] == "IL"), 'lon'] = -90.092885
-
-    data.loc[(data['city'] == "Forest Park") & (data['state'] == "IL"), 'lat'] = 41.879476
-    data.loc[(data['city'] == "Forest Park") & (data['state'] == "IL"), 'lon'] = -87.813670
-
-    data.loc[(data['city'] == "Stockton") & (data['state'] == "IL"), 'lat'] = 42.349736
-    data.loc[(data['city'] == "Stockton") & (data['state'] == "IL"), 'lon'] = -90.006792
-
-    data.loc[(data['city'] == "Lawndale") & (data['state'] == "IL"), 'lat'] = 40.218097
-    data.loc[(data['city'] == "Lawndale") & (data['state'] == "IL"), 'lon'] = -89.282592
-
-    data.loc[(data['city'] == "Harvey") & (data['state'] == "IL"), 'lat'] = 41.610034
-    data.loc[(data['city'] == "Harvey") & (data['state'] == "IL"), 'lon'] = -87.646713
-
-    data.loc[(data['city'] == "Hurst") & (data['state'] == "IL"), 'lat'] = 37.833106
-    data.loc[(data['city'] == "Hurst") & (data['state'] == "IL"), 'lon'] = -89.142857
-
-    data.loc[(data['city'] == "Dalton") & (data['state'] == "IL"), 'lat'] = 41.638924
-    data.loc[(data['city'] == "Dalton") & (data['state'] == "IL"), 'lon'] = -87.607268
-
-    data.loc[(data['city'] == "Nokomis") & (data['state'] == "IL"), 'lat'] = 39.301157
-    data.loc[(data['city'] == "Nokomis") & (data['state'] == "IL"), 'lon'] = -89.285085
-
-    data.loc[(data['city'] == "Lansing") & (data['state'] == "IL"), 'lat'] = 41.564757
-    data.loc[(data['city'] == "Lansing") & (data['state'] == "IL"), 'lon'] = -87.538931
-
-    data.loc[(data['city'] == "Arcola") & (data['state'] == "IL"), 'lat'] = 39.684755
-    data.loc[(data['city'] == "Arcola") & (data['state'] == "IL"), 'lon'] = -88.306437
-
-    data.loc[(data['city'] == "Homer") & (data['state'] == "LA"), 'lat'] = 32.791813
-    data.loc[(data['city'] == "Homer") & (data['state'] == "LA"), 'lon'] = -93.055718
-
-    data.loc[(data['city'] == "Converse") & (data['state'] == "LA"), 'lat'] = 31.781558
-    data.loc[(data['city'] == "Converse") & (data['state'] == "LA"), 'lon'] = -93.693794
-
-    data.loc[(data['city'] == "Crowley") & (data['state'] == "LA"), 'lat'] = 30.214093
-    data.loc[(data['city'] == "Crowley") & (data['state'] == "LA"), 'lon'] = -92.374576
-
-    data.loc[(data['city'] == "Harvey") & (data['state'] == "LA"), 'lat'] = 29.903539
-    data.loc[(data['city'] == "Harvey") & (data['state'] == "LA"), 'lon'] = -90.077294
-
-    data.loc[(data['city'] == "Cade") & (data['state'] == "LA"), 'lat'] = 30.088707
-    data.loc[(data['city'] == "Cade") & (data['state'] == "LA"), 'lon'] = -91.906276
-
-    data.loc[(data['city'] == "Bernice") & (data['state'] == "LA"), 'lat'] = 32.822088
-    data.loc[(data['city'] == "Bernice") & (data['state'] == "LA"), 'lon'] = -92.657930
-
-    data.loc[(data['city'] == "Monroe") & (data['state'] == "LA"), 'lat'] = 32.509311
-    data.loc[(data['city'] == "Monroe") & (data['state'] == "LA"), 'lon'] = -92.119301
-
-    data.loc[(data['city'] == "Franklin") & (data['state'] == "LA"), 'lat'] = 29.796040
-    data.loc[(data['city'] == "Franklin") & (data['state'] == "LA"), 'lon'] = -91.501500
-
-    data.loc[(data['city'] == "Pride") & (data['state'] == "LA"), 'lat'] = 30.693796
-    data.loc[(data['city'] == "Pride") & (data['state'] == "LA"), 'lon'] = -90.978159
-
-    data.loc[(data['city'] == "Gibson") & (data['state'] == "LA"), 'lat'] = 29.686876
-    data.loc[(data['city'] == "Gibson") & (data['state'] == "LA"), 'lon'] = -90.990653
-
-    data.loc[(data['city'] == "Covington") & (data['state'] == "LA"), 'lat'] = 30.475470
-    data.loc[(data['city'] == "Covington") & (data['state'] == "LA"), 'lon'] = -90.100911
-
-    data.loc[(data['city'] == "Raceland") & (data['state'] == "LA"), 'lat'] = 29.727433
-    data.loc[(data['city'] == "Raceland") & (data['state'] == "LA"), 'lon'] = -90.598976
-
-    data.loc[(data['city'] == "Slidell") & (data['state'] == "LA"), 'lat'] = 30.275195
-    data.loc[(data['city'] == "Slidell") & (data['state'] == "LA"), 'lon'] = -89.781175
-
-    data.loc[(data['city'] == "Alexandria") & (data['state'] == "LA"), 'lat'] = 31.311294
-    data.loc[(data['city'] == "Alexandria") & (data['state'] == "LA"), 'lon'] = -92.445137
+    apply_overrides(data, kind='fix')
 
-    data.loc[(data['city'] == "Lakes Charles") & (data['state'] == "LA"), 'lat'] = 30.226595
-    data.loc[(data['city'] == "Lakes Charles") & (data['state'] == "LA"), 'lon'] = -93.217376
 
-    data.loc[(data['city'] == "Gretna") & (data['state'] == "LA"), 'lat'] = 29.914649
-    data.loc[(data['city'] == "Gretna") & (data['state'] == "LA"), 'lon'] = -90.053960
-
-    data.loc[(data['city'] == "Winnsboro") & (data['state'] == "LA"), 'lat'] = 32.163208
-    data.loc[(data['city'] == "Winnsboro") & (data['state'] == "LA"), 'lon'] = -91.720681
-
-    data.loc[(data['city'] == "Killeen") & (data['state'] == "AL"), 'lat'] = 34.862864
-    data.loc[(data['city'] == "Killeen") & (data['state'] == "AL"), 'lon'] = -87.537525
-
-    data.loc[(data['city'] == "Boonville") & (data['state'] == "IN"), 'lat'] = 38.049213
-    data.loc[(data['city'] == "Boonville") & (data['state'] == "IN"), 'lon'] = -87.274172
-
-    data.loc[(data['city'] == "Geneva") & (data['state'] == "WI"), 'lat'] = 42.638605
-    data.loc[(data['city'] == "Geneva") & (data['state'] == "WI"), 'lon'] = -88.459767
-
-    data.loc[(data['city'] == "Algoma Township") & (data['state'] == "MI"), 'lat'] = 43.149293
-    data.loc[(data['city'] == "Algoma Township") & (data['state'] == "MI"), 'lon'] = -85.622930
-
-    data.loc[(data['city'] == "Cato Township") & (data['state'] == "MI"), 'lat'] = 43.443107
-    data.loc[(data['city'] == "Cato Township") & (data['state'] == "MI"), 'lon'] = -85.251548
-
-    data.loc[(data['city'] == "Columbia Township") & (data['state'] == "MI"), 'lat'] = 42.114211
-    data.loc[(data['city'] == "Columbia Township") & (data['state'] == "MI"), 'lon'] = -84.291076
-
-    data.loc[(data['city'] == "Union Township") & (data['state'] == "MI"), 'lat'] = 43.587807
-    data.loc[(data['city'] == "Union Township") & (data['state'] == "MI"), 'lon'] = -84.825510
-
-    data.loc[(data['city'] == "Holland Township") & (data['state'] == "MI"), 'lat'] = 42.812810
-    data.loc[(data['city'] == "Holland Township") & (data['state'] == "MI"), 'lon'] = -86.088390
-
-    data.loc[(data['city'] == "Manila") & (data['state'] == "AR"), 'lat'] = 35.880073
-    data.loc[(data['city'] == "Manila") & (data['state'] == "AR"), 'lon'] = -90.167039
-
-    data.loc[(data['city'] == "Sims") & (data['state'] == "AR"), 'lat'] = 34.659264
-    data.loc[(data['city'] == "Sims") & (data['state'] == "AR"), 'lon'] = -93.691029
-
-    data.loc[(data['city'] == "Little Rock") & (data['state'] == "AR"), 'lat'] = 34.746481
-    data.loc[(data['city'] == "Little Rock") & (data['state'] == "AR"), 'lon'] = -92.289595
-
-    data.loc[(data['city'] == "Sheridan") & (data['state'] == "AR"), 'lat'] = 34.307041
-    data.loc[(data['city'] == "Sheridan") & (data['state'] == "AR"), 'lon'] = -92.401265
-
-    data.loc[(data['city'] == "Benton") & (data['state'] == "AR"), 'lat'] = 34.564537
-    data.loc[(data['city'] == "Benton") & (data['state'] == "AR"), 'lon'] = -92.586828
-
-    data.loc[(data['city'] == "Farmington") & (data['state'] == "AR"), 'lat'] = 36.042025
-    data.loc[(data['city'] == "Farmington") & (data['state'] == "AR"), 'lon'] = -94.247151
+def count_armed(data):
+    """
+    Number of shootings for every armed value in each city/state pair
 
-    data.loc[(data['city'] == "Austin") & (data['state'] == "AR"), 'lat'] = 34.998421
-    data.loc[(data['city'] == "Austin") & (data['state'] == "AR"), 'lon'] = -91.983755
+    Counts of several parts of a dataset can be concatenated and summed again with
+    groupby(['city', 'state', 'armed'], dropna=False), see ingest.py.
 
-    data.loc[(data['city'] == "Romance") & (data['state'] == "AR"), 'lat'] = 35.240713
-    data.loc[(data['city'] == "Romance") & (data['state'] == "AR"), 'lon'] = -92.051904
+    Args:
+        data: Pandas dataframe of WaPo dataset
+    Returns:
+        Dataframe with city, state, armed and count columns. Rows with a missing city or
+        state are left out, a missing armed value is counted as its own value
+    """
+    counts = data.groupby(['city', 'state', 'armed'], observed=True, dropna=False, sort=False).size()
+    return counts.rename('count').reset_index().dropna(subset=['city', 'state'])
 
-    data.loc[(data['city'] == "Marion") & (data['state'] == "AR"), 'lat'] = 35.214534
-    data.loc[(data['city'] == "Marion") & (data['state'] == "AR"), 'lon'] = -90.196483
 
-    data.loc[(data['city'] == "Clarksville") & (data['state'] == "AR"), 'lat'] = 35.471472
-    data.loc[(data['city'] == "Clarksville") & (data['state'] == "AR"), 'lon'] = -93.466573
+def location_features(counts):
+    """
+    num_shootings and common_armed of every city/state pair from its armed counts
 
-    data.loc[(data['city'] == "Ozark") & (data['state'] == "AR"), 'lat'] = 35.487029
-    data.loc[(data['city'] == "Ozark") & (data['state'] == "AR"), 'lon'] = -93.827697
+    num_shootings is the number of shootings in a city/state pair and common_armed is the
+    most common armed value there. Ties go to whichever armed value comes first alphabetically.
 
-    data.loc[(data['city'] == "Pine Bluff") & (data['state'] == "AR"), 'lat'] = 34.228431
-    data.loc[(data['city'] == "Pine Bluff") & (data['state'] == "AR"), 'lon'] = -92.003196
+    Args:
+        counts: Dataframe from count_armed
+    Returns:
+        Dataframe indexed by city/state with num_shootings and common_armed columns
+    """
+    # Highest count first, ties broken by armed value in sort order (missing values last)
+    counts = counts.sort_values(['count', 'armed'], ascending=[False, True], na_position='last', kind='mergesort')
+    common_armed = counts.drop_duplicates(['city', 'state']).set_index(['city', 'state'])['armed']
+    totals = counts.groupby(['city', 'state'], observed=True)['count'].sum().reindex(common_armed.index)
+    return pd.DataFrame({'num_shootings': totals, 'common_armed': common_armed})
 
-    data.loc[(data['city'] == "Mulberry") & (data['state'] == "AR"), 'lat'] = 35.500642
-    data.loc[(data['city'] == "Mulberry") & (data['state'] == "AR"), 'lon'] = -94.051592
 
-    data.loc[(data['city'] == "Cabot") & (data['state'] == "AR"), 'lat'] = 34.974532
-    data.loc[(data['city'] == "Cabot") & (data['state'] == "AR"), 'lon'] = -92.016534
+def assign_location_features(data, features):
+    """
+    Look up num_shootings and common_armed for every row in one vectorized join
 
-    data.loc[(data['city'] == "Jonesboro") & (data['state'] == "AR"), 'lat'] = 35.842297
-    data.loc[(data['city'] == "Jonesboro") & (data['state'] == "AR"), 'lon'] = -90.704279
+    Args:
+        data: Pandas dataframe of WaPo dataset
+        features: Dataframe from location_features covering every city/state pair in data
+    Returns:
+        None, but the original data is updated with the 2 new columns. Rows with a missing
+        city or state aren't counted anywhere and get NA in both
+    """
+    positions = _pair_positions(features.index, data)
+    num_shootings = np.append(features['num_shootings'].to_numpy(dtype=float), np.nan)[positions]
+    data['num_shootings'] = pd.array(num_shootings, dtype='Int64')
+    data['common_armed'] = np.append(features['common_armed'].to_numpy(dtype=object), np.nan)[positions]
 
-    data.loc[(data['city'] == "Perryville") & (data['state'] == "AR"), 'lat'] = 35.004810
-    data.loc[(data['city'] == "Perryville") & (data['state'] == "AR"), 'lon'] = -92.802667
 
-    data.loc[(data['city'] == "Dover") & (data['state'] == "AR"), 'lat'] = 35.401471
-    data.loc[(data['city'] == "Dover") & (data['state'] == "AR"), 'lon'] = -93.114341
+@timed
+def add_location_features(data):
+    """
+    Add num_shootings and common_armed columns for every city/state pair
 
-    data.loc[(data['city'] == "Mena") & (data['state'] == "AR"), 'lat'] = 34.586217
-    data.loc[(data['city'] == "Mena") & (data['state'] == "AR"), 'lon'] = -94.239655
+    See location_features for how they are defined.
 
-    data.loc[(data['city'] == "Russellville") & (data['state'] == "AR"), 'lat'] = 35.278417
-    data.loc[(data['city'] == "Russellville") & (data['state'] == "AR"), 'lon'] = -93.133786
+    Args:
+        data: Pandas dataframe of WaPo dataset
+    Returns:
+        None, but the original data is updated with the 2 new columns
+    """
+    assign_location_features(data, location_features(count_armed(data)))
 
-    data.loc[(data['city'] == "Colorado City") & (data['state'] == "CO"), 'lat'] = 37.953320
-    data.loc[(data['city'] == "Colorado City") & (data['state'] == "CO"), 'lon'] = -104.817300
 
-    data.loc[(data['city'] == "Chester") & (data['state'] == "VA"), 'lat'] = 37.357550
-    data.loc[(data['city'] == "Chester") & (data['state'] == "VA"), 'lon'] = -77.441970
-    return
+@timed
+def refresh(csv_path=CSV_PATH, path=DATA_PATH, **kwargs):
+    """
+    Add records from a new version of the WaPo CSV to the stored dataset
 
+    The upstream CSV only grows by appending new ids, so only rows whose id isn't in the
+    store yet get their city names fixed, geocoded and patched. num_shootings and
+    common_armed are recomputed only for the cities those rows touch. Rows already in the
+    store are never updated, run the whole of DataPreparation.ipynb to pick up edits.
 
-def serialize_data(data):
+    Args:
+        csv_path: Path to latest WaPo CSV
+        path: Path to Feather file written by serialize_data, created if it doesn't exist
+        **kwargs: Passed on to get_coordinates (cache_path, backend, offline, etc)
+    Returns:
+        Updated dataframe, which is also saved to path
+    """
+    latest = read_data(csv_path)
+    if os.path.exists(path):
+        stored = load_data(path)
+        new = latest.loc[~latest['id'].isin(stored['id'])].copy()
+    else:
+        stored = None
+        new = latest
+    print("%d new records" % len(new))
+    if stored is not None and new.empty:
+        return stored
+
+    fix_city_names(new)
+    new = get_coordinates(new, **kwargs)
+    apply_overrides(new, kind='missing')
+    apply_overrides(new, kind='fix')
+
+    # Categories of stored and new rows differ so compare and combine as plain values
+    frames = [frame for frame in [stored, new] if frame is not None]
+    data = pd.concat([frame.astype({column: object for column in CATEGORICAL_COLUMNS if column in frame.columns})
+                      for frame in frames], ignore_index=True)
+    touched = pd.MultiIndex.from_arrays([new['city'].astype(object), new['state'].astype(object)]).unique()
+    affected = pd.MultiIndex.from_arrays([data['city'], data['state']]).isin(touched)
+    subset = data.loc[affected].copy()
+    add_location_features(subset)
+    if stored is not None:
+        # New rows have no num_shootings yet, which made the concatenated column float
+        data['num_shootings'] = data['num_shootings'].astype('Int64')
+    data.loc[affected, 'num_shootings'] = subset['num_shootings']
+    data.loc[affected, 'common_armed'] = subset['common_armed']
+    serialize_data(data, path)
+    return to_categoricals(data)
+
+
+def to_categoricals(data, columns=CATEGORICAL_COLUMNS):
     """
-    Serialize data to pickle file for easy loading
+    Convert low-cardinality text columns to pandas categoricals
 
     Args:
-        data: Pandas dataframe to be saved
+        data: Pandas dataframe of WaPo dataset
+        columns: Columns to convert, ones missing from data are skipped
     Returns:
-        None
+        Copy of the dataframe with categorical columns
     """
-    pd.to_pickle(data, "fatal-police-shootings-data-coordinates.pkl")
+    data = data.copy()
+    for column in columns:
+        if column in data.columns and not isinstance(data[column].dtype, pd.CategoricalDtype):
+            data[column] = data[column].astype('category')
+    return data
 
 
-def load_data():
+@timed
+def serialize_data(data, path=DATA_PATH):
     """
-    Load in previously serialized data
+    Serialize data to an uncompressed Feather (Arrow IPC) file for easy loading
+
+    Low-cardinality text columns are stored as categoricals. The file is uncompressed so it
+    can be memory-mapped, which makes reading a subset of columns or rows cheap.
 
     Args:
-        None
+        data: Pandas dataframe to be saved
+        path: Path to Feather file
     Returns:
-        Pandas dataframe containing original data plus latitude/longitude data
+        None
     """
-    data = pd.read_pickle("fatal-police-shootings-data-coordinates.pkl")
-    return data
+    from pyarrow import feather
+
+    # Write to a temporary file and swap it in so frames still memory-mapping the old file stay valid
+    temp_path = path + ".tmp"
+    feather.write_feather(to_categoricals(data).reset_index(drop=True), temp_path, compression='uncompressed')
+    os.replace(temp_path, path)
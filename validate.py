@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+import json
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 2 * np.pi * EARTH_RADIUS_KM / 360
+# Census 2016 cartographic boundary file (cb_2016_us_state_500k), public domain, simplified to ~1 km
+STATES_PATH = "us-states.geojson"
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance between points, works on scalars or numpy arrays
+
+    Args:
+        lat1, lon1: Coordinates of the first point(s) in degrees
+        lat2, lon2: Coordinates of the second point(s) in degrees
+    Returns:
+        Distance in kilometers
+    """
+    lat1, lon1, lat2, lon2 = [np.radians(x) for x in (lat1, lon1, lat2, lon2)]
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def load_state_boundaries(path=STATES_PATH, state_names=None):
+    """
+    Load state outlines from a GeoJSON file
+
+    Any US states GeoJSON works as long as each feature has the state abbreviation
+    (STUSPS) or full name (NAME or name) in its properties, e.g. the Census cartographic
+    boundary files converted to GeoJSON like the bundled us-states.geojson.
+
+    Args:
+        path: Path to GeoJSON file
+        state_names: Dictionary mapping state abbreviations to full names (utils.STATE_MAPPINGS),
+            only needed if the features have no STUSPS property
+    Returns:
+        Dictionary mapping state abbreviation to (bbox, edges) where bbox is
+        (min_lon, min_lat, max_lon, max_lat) and edges is an array of rows
+        (lon1, lat1, lon2, lat2) covering every ring of every polygon of the state
+    """
+    abbreviations = {name.lower(): abbr for abbr, name in (state_names or {}).items()}
+    with open(path) as f:
+        features = json.load(f)['features']
+    boundaries = {}
+    for feature in features:
+        properties = feature['properties']
+        state = properties.get('STUSPS') or \
+            abbreviations.get(str(properties.get('NAME', properties.get('name', ''))).lower())
+        if state is None:
+            continue
+        geometry = feature['geometry']
+        polygons = geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+        edges = []
+        for polygon in polygons:
+            for ring in polygon:
+                ring = np.asarray(ring, dtype=float)[:, :2]
+                edges.append(np.hstack([ring, np.roll(ring, -1, axis=0)]))
+        edges = np.vstack(edges)
+        bbox = (edges[:, 0].min(), edges[:, 1].min(), edges[:, 0].max(), edges[:, 1].max())
+        boundaries[state] = (bbox, edges)
+    return boundaries
+
+
+def points_in_polygon(lon, lat, edges, chunk_size=1024):
+    """
+    Even-odd ray casting test of many points against one (multi)polygon
+
+    Args:
+        lon: Array of point longitudes
+        lat: Array of point latitudes
+        edges: Array of polygon edges from load_state_boundaries
+        chunk_size: Number of points tested at once, bounds memory to chunk_size x edges
+    Returns:
+        Boolean array, True where the point is inside the polygon
+    """
+    x1, y1, x2, y2 = [edges[:, i][None, :] for i in range(4)]
+    inside = np.zeros(len(lon), dtype=bool)
+    for start in range(0, len(lon), chunk_size):
+        x = lon[start:start + chunk_size, None]
+        y = lat[start:start + chunk_size, None]
+        crosses = (y1 > y) != (y2 > y)
+        # Horizontal edges never cross so their division by zero result is ignored
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_intersect = (x2 - x1) * (y - y1) / (y2 - y1) + x1
+        inside[start:start + chunk_size] = (crosses & (x < x_intersect)).sum(axis=1) % 2 == 1
+    return inside
+
+
+def distance_to_edges(lon, lat, edges, chunk_size=256):
+    """
+    Approximate distance from each point to the nearest polygon edge
+
+    Points and edges are projected onto a plane tangent at each point's latitude, which is
+    accurate to well under a kilometer for distances of a few tens of kilometers.
+
+    Args:
+        lon: Array of point longitudes
+        lat: Array of point latitudes
+        edges: Array of polygon edges from load_state_boundaries
+        chunk_size: Number of points measured at once, bounds memory to chunk_size x edges
+    Returns:
+        Array of distances in kilometers
+    """
+    distance = np.zeros(len(lon))
+    for start in range(0, len(lon), chunk_size):
+        x = lon[start:start + chunk_size, None]
+        y = lat[start:start + chunk_size, None]
+        scale = np.cos(np.radians(y))
+        x1, x2 = (edges[:, 0][None, :] - x) * scale, (edges[:, 2][None, :] - x) * scale
+        y1, y2 = edges[:, 1][None, :] - y, edges[:, 3][None, :] - y
+        dx, dy = x2 - x1, y2 - y1
+        length = dx ** 2 + dy ** 2
+        # Position of the closest point along each edge, clipped to the edge's ends
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.clip(np.where(length > 0, -(x1 * dx + y1 * dy) / length, 0), 0, 1)
+        distance[start:start + chunk_size] = np.hypot(x1 + t * dx, y1 + t * dy).min(axis=1) * KM_PER_DEGREE
+    return distance
+
+
+def find_incorrect_coordinates(data, boundaries=STATES_PATH, border_km=10.0, min_distance_km=100.0, max_score=5.0):
+    """
+    Rank locations whose coordinates are likely geocoded incorrectly
+
+    Every unique city/state/lat/lon location is checked in one pass. Points outside their
+    state's bounding box are flagged straight away and the rest get an exact point in
+    polygon test, points within border_km of the state's outline aren't flagged since the
+    outlines are simplified and towns on a border can be geocoded just across it.
+    States without an outline fall back to flagging points far from the rest of the state:
+    score is how far the distance to the state's median point is above the median of those
+    distances, in (normal consistent) median absolute deviations. Unlike a percentile,
+    neither median is pulled up by the few wrong points being looked for. The score is
+    reported for every state but isn't used where an outline exists, since it also flags
+    correct points in states with spread-out cities (e.g. southern Oregon).
+
+    Args:
+        data: Pandas DataFrame containing original data and lat/lon data
+        boundaries: Dictionary from load_state_boundaries, path to a states GeoJSON or None
+            to only check distances
+        border_km: Points outside their state but closer than this to its outline are fine
+        min_distance_km: Points closer than this to the state's center are never distance outliers
+        max_score: Points with a higher score are distance outliers
+    Returns:
+        Dataframe of suspicious locations with city, state, lat, lon, rows (number of
+        records), outside_state, distance_km and score columns, most suspicious first
+    """
+    if isinstance(boundaries, str):
+        boundaries = load_state_boundaries(boundaries)
+    locations = data.dropna(subset=['lat', 'lon']).groupby(['state', 'city', 'lat', 'lon'], observed=True).size()
+    locations = locations.rename('rows').reset_index()
+    locations['state'] = locations['state'].astype(object)
+    locations = locations.sort_values('state', kind='mergesort').reset_index(drop=True)
+    lat = locations['lat'].to_numpy(dtype=float)
+    lon = locations['lon'].to_numpy(dtype=float)
+    states = locations['state'].to_numpy()
+
+    # Rows of each state are contiguous after sorting
+    bounds = np.flatnonzero(np.r_[True, states[1:] != states[:-1], True])
+    outside = np.zeros(len(locations), dtype=bool)
+    has_outline = np.zeros(len(locations), dtype=bool)
+    distance = np.zeros(len(locations))
+    score = np.zeros(len(locations))
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        state = states[start]
+        state_lat = lat[start:end]
+        state_lon = lon[start:end]
+        if boundaries is not None and state in boundaries:
+            (min_lon, min_lat, max_lon, max_lat), edges = boundaries[state]
+            in_bbox = (state_lon >= min_lon) & (state_lon <= max_lon) & \
+                (state_lat >= min_lat) & (state_lat <= max_lat)
+            inside = np.zeros(end - start, dtype=bool)
+            inside[in_bbox] = points_in_polygon(state_lon[in_bbox], state_lat[in_bbox], edges)
+            state_outside = ~inside
+            state_outside[state_outside] = distance_to_edges(state_lon[state_outside], state_lat[state_outside],
+                                                             edges) > border_km
+            outside[start:end] = state_outside
+            has_outline[start:end] = True
+        state_distance = haversine(state_lat, state_lon, np.median(state_lat), np.median(state_lon))
+        median = np.median(state_distance)
+        # 1.4826 scales the MAD to a standard deviation for normal data, floored at 1 km for tiny states
+        spread = max(1.4826 * np.median(np.abs(state_distance - median)), 1.0)
+        distance[start:end] = state_distance
+        score[start:end] = (state_distance - median) / spread
+
+    locations['outside_state'] = outside if boundaries is not None else np.nan
+    locations['distance_km'] = distance
+    locations['score'] = score
+    suspicious = outside | (~has_outline & (distance > min_distance_km) & (score > max_score))
+    report = locations.loc[suspicious, ['city', 'state', 'lat', 'lon', 'rows', 'outside_state', 'distance_km', 'score']]
+    return report.sort_values(['outside_state', 'score'], ascending=False).reset_index(drop=True)